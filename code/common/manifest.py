@@ -0,0 +1,86 @@
+#!/usr/bin/env python
+
+import os
+import json
+import time
+import sqlite3
+
+# open manifest database - create stage table if not exists
+def getConnection( pathname ):
+
+    # generous timeout - concurrent worker processes share manifest file
+    conn = sqlite3.connect( pathname, timeout=60 )
+    conn.execute( "CREATE TABLE IF NOT EXISTS stage ( pathname TEXT, stage TEXT, size INTEGER, mtime REAL, params TEXT, completed TEXT, " \
+                    "PRIMARY KEY ( pathname, stage ) );" )
+    conn.execute( "CREATE TABLE IF NOT EXISTS footprint ( pathname TEXT PRIMARY KEY, size INTEGER, mtime REAL, " \
+                    "min_x REAL, min_y REAL, max_x REAL, max_y REAL, crosses INTEGER );" )
+
+    return conn
+
+
+# get key identifying input file state and processing parameters
+def getKey( pathname, params ):
+
+    stat = os.stat( pathname )
+    return ( stat.st_size, stat.st_mtime, json.dumps( params, sort_keys=True ) )
+
+
+# get size and modification time of files contributing to stage output - folded into params so rewritten members invalidate entry
+def getFileState( path_list ):
+
+    return [ [ os.path.basename( obj ), os.stat( obj ).st_size, os.stat( obj ).st_mtime ] for obj in sorted( path_list ) ]
+
+
+# check stage previously completed for unchanged input and identical parameters
+def isComplete( manifest, pathname, stage, params ):
+
+    conn = getConnection( manifest )
+    row = conn.execute( "SELECT size, mtime, params FROM stage WHERE pathname = ? AND stage = ?;", ( pathname, stage ) ).fetchone()
+    conn.close()
+
+    return row is not None and tuple( row ) == getKey( pathname, params )
+
+
+# record stage completion - replaces any invalidated entry
+def setComplete( manifest, pathname, stage, params ):
+
+    size, mtime, params = getKey( pathname, params )
+
+    conn = getConnection( manifest )
+    with conn:
+        conn.execute( "INSERT OR REPLACE INTO stage VALUES ( ?, ?, ?, ?, ?, ? );",
+                        ( pathname, stage, size, mtime, params, time.strftime( '%Y-%m-%d %H:%M:%S' ) ) )
+    conn.close()
+
+    return
+
+
+# get cached footprint for unchanged scene zip - none if not cached
+def getFootprint( manifest, pathname ):
+
+    conn = getConnection( manifest )
+
+    row = conn.execute( "SELECT size, mtime, min_x, min_y, max_x, max_y, crosses FROM footprint WHERE pathname = ?;", ( pathname, ) ).fetchone()
+    conn.close()
+
+    # discard stale entries
+    stat = os.stat( pathname )
+    if row is None or ( row[ 0 ], row[ 1 ] ) != ( stat.st_size, stat.st_mtime ):
+        return None
+
+    return { 'min_x' : row[ 2 ], 'min_y' : row[ 3 ], 'max_x' : row[ 4 ], 'max_y' : row[ 5 ], 'crosses' : bool( row[ 6 ] ) }
+
+
+# cache footprint for scene zip
+def setFootprint( manifest, pathname, footprint ):
+
+    stat = os.stat( pathname )
+
+    conn = getConnection( manifest )
+    with conn:
+        conn.execute( "INSERT OR REPLACE INTO footprint VALUES ( ?, ?, ?, ?, ?, ?, ?, ? );", 
+                        ( pathname, stat.st_size, stat.st_mtime, 
+                            footprint[ 'min_x' ], footprint[ 'min_y' ], footprint[ 'max_x' ], footprint[ 'max_y' ], int( footprint[ 'crosses' ] ) ) )
+    conn.close()
+
+    return
@@ -0,0 +1,197 @@
+#!/usr/bin/env python
+
+import psycopg2
+from psycopg2.extensions import AsIs
+
+import pgsql
+
+# get schema of paired sample tables - mirrors result schema naming ( result_flat -> pairs_flat )
+def getSchema( plist ):
+
+    return plist[ 'in_schema' ].replace( 'result', 'pairs' )
+
+
+# get qualified name of paired sample view - scene metadata joined on read
+def getTable( plist ):
+
+    return '{}.{}_{}'.format( getSchema( plist ), plist[ 'product' ], plist[ 'landcover' ] )
+
+
+# get qualified name of stored paired samples
+def getDataTable( plist ):
+
+    return getTable( plist ) + '_samples'
+
+
+# get result tables holding gamma / snap value pairs - fused sampler output if present, otherwise per algorithm result tables
+def getResultTables( cur, plist ):
+
+    table = plist[ 'product' ] + '_' + plist[ 'landcover' ]
+
+    cur.execute( "SELECT to_regclass( %s );", [ '{}_paired.{}'.format( plist[ 'in_schema' ], table ) ] )
+    if cur.fetchone()[ 0 ] is not None:
+        return [ '{}_paired.{}'.format( plist[ 'in_schema' ], table ) ]
+
+    return [ '{}_gamma.{}'.format( plist[ 'in_schema' ], table ), '{}_snap.{}'.format( plist[ 'in_schema' ], table ) ]
+
+
+# get source of gamma / snap value pairs - optionally restricted to scene ids listed per result table
+def getSourceSql( cur, tables, fids=None ):
+
+    # fused sampler output
+    if len( tables ) == 1:
+
+        query = "SELECT fdate, point_id, gamma_vv, gamma_vh, snap_vv, snap_vh FROM {}".format( tables[ 0 ] )
+        if fids is not None:
+            query += cur.mogrify( " WHERE fid = ANY( %s::integer[] )", [ fids[ 0 ] ] ).decode()
+
+        return query
+
+    # per algorithm result tables joined on acquisition and point id
+    query = "SELECT a.fdate, a.point_id, a.vv gamma_vv, a.vh gamma_vh, b.vv snap_vv, b.vh snap_vh FROM {} a " \
+                "INNER JOIN {} b ON a.fdate = b.fdate AND a.point_id = b.point_id".format( *tables )
+    if fids is None:
+        return query
+
+    # scenes new to either algorithm - union keeps fid lookups on each table indexable
+    return ' UNION '.join( [ query + cur.mogrify( " WHERE {}.fid = ANY( %s::integer[] )".format( alias ), [ ids ] ).decode() for alias, ids in zip( [ 'a', 'b' ], fids ) ] )
+
+
+# get completion records of result tables not yet paired - none if any result table predates completion records
+def getPendingScenes( cur, plist, tables ):
+
+    pending = []
+    for table in tables:
+
+        # table oid distinguishes result tables regenerated since last refresh
+        cur.execute( "SELECT to_regclass( %s )::oid;", [ table + '_done' ] )
+        source = cur.fetchone()[ 0 ]
+        if source is None:
+            return None
+
+        cur.execute( "SELECT fid, block FROM %s_done EXCEPT SELECT fid, block FROM %s_sources WHERE source = %s;", 
+                        ( AsIs( table ), AsIs( getDataTable( plist ) ), source ) )
+        pending.append( ( source, cur.fetchall() ) )
+
+    return pending
+
+
+# get sequence number of last paired sample merged into derived table - none if not recorded or paired samples recreated since
+def getMerged( cur, plist, table ):
+
+    cur.execute( "SELECT to_regclass( %s );", [ table + '_merged' ] )
+    if cur.fetchone()[ 0 ] is None:
+        return None
+
+    cur.execute( "SELECT seq FROM %s_merged WHERE source = to_regclass( %s )::oid;", ( AsIs( table ), getDataTable( plist ) ) )
+    row = cur.fetchone()
+
+    return row[ 0 ] if row is not None else None
+
+
+# get sequence number bounding next batch merged into derived table - samples of scenes without metadata deferred with all later samples
+def getSequence( cur, plist, merged ):
+
+    cur.execute( "SELECT MIN( seq ) FROM %s WHERE seq > %s AND filename IS NULL;", ( AsIs( getTable( plist ) ), merged ) )
+    seq = cur.fetchone()[ 0 ]
+    if seq is not None:
+        print ( '... paired samples from {} onward deferred - scene metadata missing from meta'.format( seq ) )
+        return seq - 1
+
+    cur.execute( "SELECT COALESCE( MAX( seq ), 0 ) FROM %s;", [ AsIs( getDataTable( plist ) ) ] )
+    return cur.fetchone()[ 0 ]
+
+
+# record sequence number of last paired sample merged into derived table - executed within transaction writing derived rows
+def setMerged( cur, plist, table, seq ):
+
+    cur.execute( "CREATE TABLE IF NOT EXISTS %s_merged ( source OID, seq BIGINT );", [ AsIs( table ) ] )
+    cur.execute( "TRUNCATE %s_merged;", [ AsIs( table ) ] )
+    cur.execute( "INSERT INTO %s_merged VALUES ( to_regclass( %s )::oid, %s );", ( AsIs( table ), getDataTable( plist ), seq ) )
+
+    # acquisition tracking tables superseded by sequence number
+    cur.execute( "DROP TABLE IF EXISTS %s_fdates;", [ AsIs( table ) ] )
+
+    return
+
+
+# create or incrementally refresh paired sample table - only scenes completed since last refresh are paired
+def refreshTable( plist, rebuild=False ):
+
+    table = getTable( plist )
+    data = getDataTable( plist )
+    name = data.replace( '.', '_' )
+
+    # get connection
+    conn = pgsql.getConnection( plist[ 'db' ] )
+    cur = conn.cursor()
+
+    try:
+
+        # create paired schema if not exists
+        cur.execute( "CREATE SCHEMA IF NOT EXISTS %s;", [ AsIs( getSchema( plist ) ) ] )
+
+        # paired tables created with copied scene metadata - replaced by view, samples re-paired from result tables
+        cur.execute( "SELECT relkind FROM pg_class WHERE oid = to_regclass( %s );", [ table ] )
+        row = cur.fetchone()
+        if row is not None and row[ 0 ] == 'r':
+            cur.execute( "DROP TABLE %s;", [ AsIs( table ) ] )
+
+        # delete paired tables - result tables regenerated from scratch
+        if rebuild:
+            cur.execute( "DROP VIEW IF EXISTS %s;", [ AsIs( table ) ] )
+            cur.execute( "DROP TABLE IF EXISTS %s, %s_sources;", ( AsIs( data ), AsIs( data ) ) )
+
+        tables = getResultTables( cur, plist )
+        cur.execute( "SELECT to_regclass( %s );", [ data ] )
+        exists = cur.fetchone()[ 0 ] is not None
+
+        # column types inherited from result tables - sequence number orders samples by refresh for derived table watermarks
+        if not exists:
+            cur.execute( "CREATE TABLE %s AS %s WITH NO DATA;", ( AsIs( data ), AsIs( getSourceSql( cur, tables ) ) ) )
+            cur.execute( "ALTER TABLE %s ADD COLUMN seq BIGSERIAL;", [ AsIs( data ) ] )
+
+        # completion records consumed tracked per result table
+        cur.execute( "CREATE TABLE IF NOT EXISTS %s_sources ( source OID, fid INTEGER, block TEXT, PRIMARY KEY ( source, fid, block ) );", [ AsIs( data ) ] )
+        cur.execute( "CREATE INDEX IF NOT EXISTS %s_fdate_point_id_idx ON %s ( fdate, point_id );", ( AsIs( name ), AsIs( data ) ) )
+        cur.execute( "CREATE INDEX IF NOT EXISTS %s_seq_idx ON %s ( seq );", ( AsIs( name ), AsIs( data ) ) )
+
+        # concurrent refreshes serialised - sequence numbers committed in order, readers not blocked
+        cur.execute( "LOCK TABLE %s IN SHARE ROW EXCLUSIVE MODE;", [ AsIs( data ) ] )
+
+        # scene metadata joined on read - ingested or corrected metadata visible without refresh
+        cur.execute( "CREATE OR REPLACE VIEW %s AS SELECT s.fdate, s.point_id, s.gamma_vv, s.gamma_vh, s.snap_vv, s.snap_vh, " \
+                        "c.filename, c.orbitdirection, c.relativeorbitnumber, s.seq FROM %s s LEFT JOIN meta c ON s.fdate = c.fdate;", ( AsIs( table ), AsIs( data ) ) )
+
+        # restrict source to scenes completed since last refresh - full source for new tables or result tables without completion records
+        pending = getPendingScenes( cur, plist, tables )
+        source = getSourceSql( cur, tables )
+        if exists and pending is not None:
+            source = getSourceSql( cur, tables, [ [ fid for fid, block in records ] for oid, records in pending ] )
+
+        # append samples not yet paired - points backfilled for existing acquisitions included
+        cur.execute( "INSERT INTO %s ( fdate, point_id, gamma_vv, gamma_vh, snap_vv, snap_vh ) SELECT * FROM ( %s ) s WHERE NOT EXISTS ( SELECT 1 FROM %s p WHERE p.fdate = s.fdate AND p.point_id = s.point_id );",
+                        ( AsIs( data ), AsIs( source ), AsIs( data ) ) )
+        print ( '... {} rows appended to {}'.format( cur.rowcount, data ) )
+
+        # record completion records consumed - written in same transaction as paired samples
+        if pending is not None:
+
+            cur.execute( "DELETE FROM %s_sources WHERE source <> ALL( %s::oid[] );", ( AsIs( data ), [ oid for oid, records in pending ] ) )
+            for oid, records in pending:
+                cur.execute( "INSERT INTO %s_sources SELECT %s, unnest( %s::integer[] ), unnest( %s::text[] );", 
+                                ( AsIs( data ), oid, [ fid for fid, block in records ], [ block for fid, block in records ] ) )
+
+        # point id index supports per point aggregation
+        cur.execute( "CREATE INDEX IF NOT EXISTS %s_point_id_idx ON %s ( point_id );", ( AsIs( name ), AsIs( data ) ) )
+        cur.execute( "ANALYZE %s;", [ AsIs( data ) ] )
+        conn.commit()
+
+    # handle exception
+    except psycopg2.Error as e:
+        print ( e.pgerror )
+
+    # close connection
+    pgsql.releaseConnection( conn )
+
+    return table
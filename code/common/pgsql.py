@@ -0,0 +1,90 @@
+#!/usr/bin/env python
+
+import os
+import time
+import atexit
+import threading
+
+from psycopg2.pool import ThreadedConnectionPool
+from psycopg2.extensions import cursor
+
+# connection string template - database name substituted per connection
+dsn = os.environ.get( 'S1ARD_DSN', "dbname='{}' user='sac' host='localhost' password='sac'" )
+
+# maximum connections per database per process
+max_connections = int( os.environ.get( 'S1ARD_MAX_CONNECTIONS', 32 ) )
+
+# report elapsed time of each query - off unless debug timing requested (S1ARD_QUERY_TIMING=1 or pgsql.timing = True)
+timing = os.environ.get( 'S1ARD_QUERY_TIMING', '0' ) != '0'
+
+# pools keyed on process id and database - child processes never share parent connections
+pools = {}
+owners = {}
+lock = threading.Lock()
+
+
+# cursor reporting elapsed time per query
+class TimedCursor( cursor ):
+
+    def execute( self, query, vars=None ):
+
+        start = time.time()
+        try:
+            return super().execute( query, vars )
+
+        finally:
+            if timing:
+                print ( '... query completed in {:.2f}s: {}'.format( time.time() - start, ' '.join( str( query ).split() )[ :80 ] ) )
+
+
+    def copy_expert( self, sql, file, size=8192 ):
+
+        start = time.time()
+        try:
+            return super().copy_expert( sql, file, size )
+
+        finally:
+            if timing:
+                print ( '... copy completed in {:.2f}s: {}'.format( time.time() - start, ' '.join( sql.split() )[ :80 ] ) )
+
+
+# get thread-safe pool for database owned by current process
+def getPool( db ):
+
+    key = ( os.getpid(), db )
+    with lock:
+
+        if key not in pools:
+            pools[ key ] = ThreadedConnectionPool( 1, max_connections, dsn.format( db ), cursor_factory=TimedCursor )
+
+    return pools[ key ]
+
+
+# borrow connection from pool
+def getConnection( db ):
+
+    pool = getPool( db )
+
+    conn = pool.getconn()
+    owners[ id( conn ) ] = pool
+
+    return conn
+
+
+# return connection to pool - open transactions rolled back by pool
+def releaseConnection( conn ):
+
+    owners.pop( id( conn ) ).putconn( conn )
+    return
+
+
+# close connections opened by current process
+@atexit.register
+def closePools():
+
+    for key in list( pools.keys() ):
+
+        if key[ 0 ] == os.getpid():
+            pools.pop( key ).closeall()
+
+    return
@@ -0,0 +1,189 @@
+#!/usr/bin/env python
+
+import os
+import io
+import csv
+import shutil
+
+import numpy as np
+from osgeo import gdal, osr
+
+# tiled, compressed geotiff layout shared by warp and ingestion stages
+tile_options = [ 'TILED=YES', 'BLOCKXSIZE=256', 'BLOCKYSIZE=256', 'COMPRESS=DEFLATE', 'BIGTIFF=IF_SAFER' ]
+overview_levels = [ 2, 4, 8, 16 ]
+
+# filename tokens identifying categorical layers - class codes must not be averaged
+categorical_layers = [ 'ls_map', 'mask' ]
+
+# get overview resampling for image - nearest neighbour for categorical layers, average for continuous backscatter and angles
+def getOverviewResampling( pathname ):
+
+    name = os.path.basename( pathname )
+    return 'NEAREST' if any( [ token in name for token in categorical_layers ] ) else 'AVERAGE'
+
+
+# warp image to target epsg - tiled, compressed geotiff with overviews written in single pass
+def warpToTiles( src_pathname, dst_pathname, epsg, res, resampling=None ):
+
+    # aligned pixels guarantee identical grid for every image warped from same scene
+    options = gdal.WarpOptions(     format='GTiff',
+                                    dstSRS='EPSG:{}'.format( epsg ),
+                                    xRes=res, yRes=res,
+                                    targetAlignedPixels=True,
+                                    creationOptions=tile_options )
+
+    # write to temporary file - incomplete output never left under final name
+    tmp_pathname = dst_pathname + '.tmp'
+    dst_ds = gdal.Warp( tmp_pathname, src_pathname, options=options )
+    if dst_ds is None:
+        raise RuntimeError( 'unable to warp image: ' + src_pathname )
+
+    # overview resampling inferred from filename unless given
+    if resampling is None:
+        resampling = getOverviewResampling( src_pathname )
+
+    dst_ds.BuildOverviews( resampling, overview_levels )
+    dst_ds = None
+
+    shutil.move( tmp_pathname, dst_pathname )
+    return
+
+
+# check image already stored with layout defined by creation options - avoids redundant rewrite
+def isConformant( pathname, options=tile_options ):
+
+    src_ds = gdal.Open( pathname )
+    if src_ds is None or src_ds.GetDriver().ShortName != 'GTiff':
+        return False
+
+    # parse expected layout from creation options
+    layout = dict( [ obj.split( '=', 1 ) for obj in options ] )
+
+    if 'TILED' in layout:
+        block = [ int( layout.get( 'BLOCKXSIZE', 256 ) ), int( layout.get( 'BLOCKYSIZE', 256 ) ) ]
+        for idx in range( src_ds.RasterCount ):
+            if src_ds.GetRasterBand( idx + 1 ).GetBlockSize() != block:
+                return False
+
+    if layout.get( 'COMPRESS', 'NONE' ) != ( src_ds.GetMetadataItem( 'COMPRESSION', 'IMAGE_STRUCTURE' ) or 'NONE' ):
+        return False
+
+    if 'INTERLEAVE' in layout and src_ds.RasterCount > 1:
+        if layout[ 'INTERLEAVE' ] != src_ds.GetMetadataItem( 'INTERLEAVE', 'IMAGE_STRUCTURE' ):
+            return False
+
+    return True
+
+
+# rewrite image in place with layout defined by creation options
+def rewriteTiles( pathname, options=tile_options ):
+
+    # create copy with tiled options
+    driver = gdal.GetDriverByName( "GTiff" )
+    src_ds = gdal.Open( pathname )
+    new_ds = driver.CreateCopy( pathname + '.tmp', src_ds, options = options )
+    
+    new_ds.FlushCache()
+    new_ds = None; src_ds = None
+
+    # overwrite existing file
+    shutil.move( pathname + '.tmp', pathname )
+    return
+
+
+# get epsg code of image spatial reference - none if not identified
+def getEpsg( pathname ):
+
+    src_ds = gdal.Open( pathname )
+    if src_ds is None:
+        raise RuntimeError( 'unable to open image: ' + pathname )
+
+    srs = osr.SpatialReference( wkt=src_ds.GetProjection() )
+    srs.AutoIdentifyEPSG()
+
+    code = srs.GetAuthorityCode( None )
+    return int( code ) if code is not None else None
+
+
+# get indices of pixels containing point coordinates - single inverse affine transform, mask of points inside image
+def getPixelIndices( src_ds, x, y ):
+
+    inv = gdal.InvGeoTransform( src_ds.GetGeoTransform() )
+    col = np.floor( inv[ 0 ] + inv[ 1 ] * x + inv[ 2 ] * y ).astype( np.int64 )
+    row = np.floor( inv[ 3 ] + inv[ 4 ] * x + inv[ 5 ] * y ).astype( np.int64 )
+
+    return col, row, ( col >= 0 ) & ( col < src_ds.RasterXSize ) & ( row >= 0 ) & ( row < src_ds.RasterYSize )
+
+
+# sample pixel values at point coordinates - single affine transform to pixel indices, pixels read block by block
+def samplePoints( pathname, bands, x, y, block=256 ):
+
+    src_ds = gdal.Open( pathname )
+    if src_ds is None:
+        raise RuntimeError( 'unable to open image: ' + pathname )
+
+    # nan where point falls outside image or pixel is nodata
+    values = np.full( ( len( x ), len( bands ) ), np.nan )
+
+    col, row, inside = getPixelIndices( src_ds, x, y )
+    inside = np.flatnonzero( inside )
+
+    # group points by block - sorted so each group is contiguous
+    blocks_x = ( src_ds.RasterXSize + block - 1 ) // block
+    keys = ( row[ inside ] // block ) * blocks_x + ( col[ inside ] // block )
+
+    order = np.argsort( keys, kind='stable' )
+    keys = keys[ order ]; inside = inside[ order ]
+
+    block_keys, starts = np.unique( keys, return_index=True )
+    band_list = [ src_ds.GetRasterBand( idx ) for idx in bands ]
+
+    # read only blocks containing points
+    for key, subset in zip( block_keys, np.split( inside, starts[ 1: ] ) ):
+
+        xoff = int( key % blocks_x ) * block; yoff = int( key // blocks_x ) * block
+        xsize = min( block, src_ds.RasterXSize - xoff ); ysize = min( block, src_ds.RasterYSize - yoff )
+
+        for idx, band in enumerate( band_list ):
+
+            data = band.ReadAsArray( xoff, yoff, xsize, ysize ).astype( np.float64 )
+            data = data[ row[ subset ] - yoff, col[ subset ] - xoff ]
+
+            nodata = band.GetNoDataValue()
+            if nodata is not None:
+                data[ data == nodata ] = np.nan
+
+            values[ subset, idx ] = data
+
+    return values
+
+
+# bulk load rows fetched by query with first band value of image at each point - query returns loaded columns followed by point x, y in image reference system
+def copyPointValues( cur, pathname, query, params, table, columns, drop_nodata=False ):
+
+    cur.execute( query, params )
+    points = cur.fetchall()
+
+    x = np.array( [ point[ -2 ] for point in points ], dtype=np.float64 )
+    y = np.array( [ point[ -1 ] for point in points ], dtype=np.float64 )
+
+    # points outside image dropped - nodata pixels loaded as null unless dropped
+    src_ds = gdal.Open( pathname )
+    if src_ds is None:
+        raise RuntimeError( 'unable to open image: ' + pathname )
+
+    keep = getPixelIndices( src_ds, x, y )[ 2 ]
+    values = samplePoints( pathname, [ 1 ], x, y )[ :, 0 ]
+    if drop_nodata:
+        keep &= ~np.isnan( values )
+
+    buffer = io.StringIO()
+    writer = csv.writer( buffer )
+    for idx in np.flatnonzero( keep ):
+        writer.writerow( list( points[ idx ][ :-2 ] ) + [ '' if np.isnan( values[ idx ] ) else values[ idx ] ] )
+
+    # bulk load rows
+    buffer.seek( 0 )
+    cur.copy_expert( "COPY {} ( {} ) FROM STDIN WITH CSV".format( table, ', '.join( columns ) ), buffer )
+
+    return int( np.count_nonzero( keep ) )
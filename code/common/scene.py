@@ -0,0 +1,126 @@
+#!/usr/bin/env python
+
+import os
+import fnmatch
+import zipfile
+
+import numpy as np
+from osgeo import gdal
+
+import manifest
+
+# get gdal virtual pathname of first measurement image inside scene zip - reads zip directory only
+def getMeasurementPath( pathname ):
+
+    with zipfile.ZipFile( pathname ) as archive:
+        filelist = sorted( [ obj for obj in archive.namelist() if fnmatch.fnmatch( obj, '*/measurement/*.tiff' ) ] )
+
+    path = None
+    if len( filelist ) > 0:
+        path = '/vsizip/' + os.path.abspath( pathname ) + '/' + filelist[ 0 ]
+
+    return path
+
+
+# compute scene footprint - gcps read in place from tiff header inside zip
+def readFootprint( pathname ):
+
+    footprint = None
+
+    # open scene and extract gcps
+    path = getMeasurementPath( pathname )
+    if path is not None:
+
+        in_ds = gdal.Open( path )
+        if in_ds is not None:
+
+            gcps = in_ds.GetGCPs()
+            if len( gcps ) > 0:
+
+                # fill coordinate buffers directly from gcp objects - no intermediate tuple list
+                x = np.fromiter( ( gcp.GCPX for gcp in gcps ), dtype=np.float64, count=len( gcps ) )
+                y = np.fromiter( ( gcp.GCPY for gcp in gcps ), dtype=np.float64, count=len( gcps ) )
+
+                # large longitude difference when crossing antimeridian 
+                crosses = bool( np.ptp( x ) >= 10 )
+
+                # unwrap longitudes onto 0 to 360 domain
+                if crosses:
+                    x = np.where( x < 0, x + 360.0, x )
+
+                footprint = {   'min_x' : float( x.min() ), 
+                                'min_y' : float( y.min() ), 
+                                'max_x' : float( x.max() ), 
+                                'max_y' : float( y.max() ), 
+                                'crosses' : crosses }
+
+    return footprint
+
+
+# get scene footprint - optionally cached in manifest
+def getFootprint( pathname, cache=None ):
+
+    # retrieve cached footprint for unchanged zip
+    footprint = None
+    if cache is not None:
+        footprint = manifest.getFootprint( cache, pathname )
+
+    if footprint is None:
+
+        try:
+            footprint = readFootprint( pathname )
+
+        # handle exception
+        except zipfile.BadZipFile as e:
+            print ( '... unable to read scene: {} ({})'.format ( pathname, str( e ) ) )
+
+        # unreadable scenes are not cached - retried on next run
+        if footprint is not None and cache is not None:
+            manifest.setFootprint( cache, pathname, footprint )
+
+    return footprint
+
+
+# check footprint intersects latitude / longitude bbox (xmin ymin xmax ymax) - xmin > xmax denotes aoi crossing antimeridian
+def intersectsAoi( footprint, aoi ):
+
+    # unwrap antimeridian aoi onto 0 to 360 domain
+    min_x = aoi[ 0 ]; max_x = aoi[ 2 ]
+    if min_x > max_x:
+        max_x += 360.0
+
+    # test aoi shifted onto domain of footprint - either side of antimeridian
+    for offset in [ -360.0, 0.0, 360.0 ]:
+
+        if min_x + offset <= footprint[ 'max_x' ] and max_x + offset >= footprint[ 'min_x' ] \
+                and aoi[ 1 ] <= footprint[ 'max_y' ] and aoi[ 3 ] >= footprint[ 'min_y' ]:
+            return True
+
+    return False
+
+
+# filter scene list by aoi intersection
+def filterScenes( scene_list, aoi, cache=None ):
+
+    filtered_list = []
+    for pathname in scene_list:
+
+        footprint = getFootprint( pathname, cache )
+        if footprint is not None and intersectsAoi( footprint, aoi ):
+            filtered_list.append( pathname )
+
+    print ( '... {} of {} scenes intersect aoi'.format( len( filtered_list ), len( scene_list ) ) )
+    return filtered_list
+
+
+# validate scene file and coverage - status is ok, unreadable (zip or measurement image not read) or crosses (antimeridian)
+def checkScene( pathname, cache=None ):
+
+    footprint = getFootprint( pathname, cache )
+    if footprint is None:
+        return 'unreadable'
+
+    if footprint[ 'crosses' ]:
+        return 'crosses'
+
+    return 'ok'
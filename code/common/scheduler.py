@@ -0,0 +1,142 @@
+#!/usr/bin/env python
+
+import os
+import sys
+import time
+import threading
+import traceback
+
+from multiprocessing import Pool
+from concurrent.futures import ThreadPoolExecutor
+
+# execute single task - capture outcome and wall time
+def runTask( task ):
+
+    func, obj, args = task
+    result = { 'task' : obj, 'status' : 'ok', 'elapsed' : 0.0, 'error' : None }
+
+    start = time.time()
+    try:
+
+        # optional status returned by task function
+        status = func( obj, args )
+        if status is not None:
+            result[ 'status' ] = status
+
+    # handle exception - record failure and move on
+    except Exception as e:
+
+        result[ 'status' ] = 'failed'
+        result[ 'error' ] = str( e )
+        traceback.print_exc()
+
+    result[ 'elapsed' ] = time.time() - start
+    sys.stdout.flush()
+
+    return result
+
+
+# execute tasks serially or concurrently across pool of worker processes
+def runTasks( func, obj_list, args, workers=1, maxtasks=None ):
+
+    results = []
+    tasks = [ ( func, obj, args ) for obj in obj_list ]
+
+    if workers > 1:
+
+        # pool size caps number of concurrent tasks - recycle workers to release memory
+        with Pool( processes=workers, maxtasksperchild=maxtasks ) as pool:
+            for result in pool.imap_unordered( runTask, tasks ):
+                results.append( result )
+
+    else:
+
+        # serial execution within current process
+        for task in tasks:
+            results.append( runTask( task ) )
+
+    return results
+
+
+# execute tasks across bounded pool of threads - retry transient failures and report progress
+def runThreads( func, tasks, threads=1, retries=0, transient=(), weight=None ):
+
+    lock = threading.Lock()
+    progress = { 'count' : 0, 'done' : 0.0, 'total' : float( sum( [ weight( task ) if weight else 1 for task in tasks ] ) ) }
+    start = time.time()
+
+    # execute single task - transient errors retried with backoff
+    def runTaskWithRetry( task ):
+
+        result = { 'task' : task, 'status' : 'ok', 'elapsed' : 0.0, 'error' : None }
+        task_start = time.time()
+
+        for attempt in range( retries + 1 ):
+
+            try:
+                func( task )
+                result[ 'status' ] = 'ok'; result[ 'error' ] = None
+                break
+
+            # handle transient exception - retry unless attempts exhausted
+            except transient as e:
+
+                result[ 'status' ] = 'failed'; result[ 'error' ] = str( e ).strip()
+                if attempt < retries:
+                    print ( '... transient error - retry {} of {}: {}'.format( attempt + 1, retries, result[ 'error' ] ) )
+                    time.sleep( 2 ** attempt )
+
+            # handle exception - record failure and move on
+            except Exception as e:
+
+                result[ 'status' ] = 'failed'; result[ 'error' ] = str( e ).strip()
+                traceback.print_exc()
+                break
+
+        result[ 'elapsed' ] = time.time() - task_start
+
+        # report progress with estimated time remaining
+        with lock:
+
+            progress[ 'count' ] += 1
+            progress[ 'done' ] += weight( task ) if weight else 1
+
+            elapsed = time.time() - start
+            eta = elapsed * ( progress[ 'total' ] - progress[ 'done' ] ) / max( progress[ 'done' ], 1e-9 )
+
+            print ( '... completed {} of {} tasks ({:.1f}%) - elapsed {:.0f}s - eta {:.0f}s'.format( progress[ 'count' ], len( tasks ), 
+                        100.0 * progress[ 'done' ] / max( progress[ 'total' ], 1e-9 ), elapsed, eta ) )
+            sys.stdout.flush()
+
+        return result
+
+    # pool size caps concurrent tasks - idle threads pick up next queued task
+    with ThreadPoolExecutor( max_workers=max( threads, 1 ) ) as executor:
+        results = list( executor.map( runTaskWithRetry, tasks ) )
+
+    return results
+
+
+# print per-task wall time and failures
+def printSummary( results, label=None ):
+
+    # count outcomes
+    counts = {}
+    for result in results:
+        counts[ result[ 'status' ] ] = counts.get( result[ 'status' ], 0 ) + 1
+
+    elapsed = sum( [ result[ 'elapsed' ] for result in results ] )
+    print ( 'summary: {} tasks - {} - total {:.1f}s'.format( len( results ),
+                ', '.join( [ '{} {}'.format( counts[ key ], key ) for key in sorted( counts ) ] ), elapsed ) )
+
+    # per task wall time
+    for result in sorted( results, key=lambda r: label( r[ 'task' ] ) if label else str( r[ 'task' ] ) ):
+
+        name = label( result[ 'task' ] ) if label else os.path.basename( str( result[ 'task' ] ) )
+        line = '... {:<8} {:>9.1f}s  {}'.format( result[ 'status' ], result[ 'elapsed' ], name )
+        if result[ 'error' ] is not None:
+            line += ' : ' + result[ 'error' ]
+
+        print ( line )
+
+    return
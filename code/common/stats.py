@@ -0,0 +1,215 @@
+#!/usr/bin/env python
+
+import numpy as np
+
+from concurrent.futures import ThreadPoolExecutor
+
+# create empty statistics state - per group key count, mean and sum of squared deviations (m2) of each variable
+def getState( names ):
+
+    return {    'names' : list( names ),
+                'size' : 0,
+                'keys' : None,
+                'lookup' : None,
+                'rows' : None,
+                'count' : np.zeros( ( 0, len( names ) ) ),
+                'mean' : np.zeros( ( 0, len( names ) ) ),
+                'm2' : np.zeros( ( 0, len( names ) ) ) }
+
+
+# grow state arrays to hold at least size groups - capacity doubled so appends are amortised
+def reserve( state, size, dtype ):
+
+    capacity = len( state[ 'count' ] )
+    if size > capacity:
+
+        capacity = max( size, 2 * capacity, 1024 )
+        for field in [ 'count', 'mean', 'm2' ]:
+
+            obj = np.zeros( ( capacity, len( state[ 'names' ] ) ) )
+            obj[ :state[ 'size' ] ] = state[ field ][ :state[ 'size' ] ]
+            state[ field ] = obj
+
+        keys = np.empty( capacity, dtype=dtype if state[ 'keys' ] is None else state[ 'keys' ].dtype )
+        if state[ 'keys' ] is not None:
+            keys[ :state[ 'size' ] ] = state[ 'keys' ][ :state[ 'size' ] ]
+
+        state[ 'keys' ] = keys
+
+    return
+
+
+# get state rows of unique keys - sorted key lookup resolved by binary search, unseen keys appended as empty groups
+def getRows( state, keys ):
+
+    keys = np.asarray( keys )
+    order = np.argsort( keys, kind='stable' )
+    keys = keys[ order ]
+
+    # locate keys in sorted lookup
+    size = state[ 'size' ]
+    found = np.zeros( len( keys ), dtype=bool )
+    pos = np.zeros( len( keys ), dtype=np.int64 )
+
+    rows = np.empty( len( keys ), dtype=np.int64 )
+    if size > 0:
+
+        pos = np.searchsorted( state[ 'lookup' ], keys )
+        found = pos < size
+        found[ found ] = state[ 'lookup' ][ pos[ found ] ] == keys[ found ]
+
+        rows[ found ] = state[ 'rows' ][ pos[ found ] ]
+
+    # unseen keys take next free rows - inserted into lookup in sorted order
+    new = np.flatnonzero( ~found )
+    if len( new ) > 0:
+
+        rows[ new ] = size + np.arange( len( new ) )
+        reserve( state, size + len( new ), keys.dtype )
+        state[ 'keys' ][ size:size + len( new ) ] = keys[ new ]
+
+        if size > 0:
+            state[ 'lookup' ] = np.insert( state[ 'lookup' ], pos[ new ], keys[ new ] )
+            state[ 'rows' ] = np.insert( state[ 'rows' ], pos[ new ], rows[ new ] )
+        else:
+            state[ 'lookup' ] = keys[ new ]
+            state[ 'rows' ] = rows[ new ]
+
+        state[ 'size' ] = size + len( new )
+
+    # restore caller key order
+    result = np.empty( len( keys ), dtype=np.int64 )
+    result[ order ] = rows
+
+    return result
+
+
+# fold partial statistics into state rows - chan parallel combination of count, mean and m2
+def mergeRows( state, rows, count, mean, m2 ):
+
+    n_a = state[ 'count' ][ rows ]; n_b = count
+    n = n_a + n_b
+
+    with np.errstate( invalid='ignore', divide='ignore' ):
+
+        delta = mean - state[ 'mean' ][ rows ]
+        state[ 'mean' ][ rows ] = np.where( n > 0, state[ 'mean' ][ rows ] + delta * n_b / n, 0.0 )
+        state[ 'm2' ][ rows ] = np.where( n > 0, state[ 'm2' ][ rows ] + m2 + delta ** 2 * n_a * n_b / n, 0.0 )
+
+    state[ 'count' ][ rows ] = n
+    return
+
+
+# update state with batch of samples - nan values ignored
+def updateState( state, keys, values ):
+
+    values = np.asarray( values, dtype=np.float64 )
+
+    # group batch on key
+    groups, inverse = np.unique( np.asarray( keys ), return_inverse=True )
+    inverse = inverse.ravel()
+
+    valid = ~np.isnan( values )
+    data = np.where( valid, values, 0.0 )
+
+    count = np.zeros( ( len( groups ), values.shape[ 1 ] ) )
+    total = np.zeros( ( len( groups ), values.shape[ 1 ] ) )
+
+    np.add.at( count, inverse, valid )
+    np.add.at( total, inverse, data )
+
+    # two pass batch statistics - deviations taken from batch mean for stability
+    with np.errstate( invalid='ignore', divide='ignore' ):
+        mean = np.where( count > 0, total / count, 0.0 )
+
+    m2 = np.zeros( ( len( groups ), values.shape[ 1 ] ) )
+    np.add.at( m2, inverse, np.where( valid, ( values - mean[ inverse ] ) ** 2, 0.0 ) )
+
+    mergeRows( state, getRows( state, groups ), count, mean, m2 )
+    return state
+
+
+# merge partial state computed by another worker
+def mergeState( state, other ):
+
+    size = other[ 'size' ]
+    if size > 0:
+        mergeRows( state, getRows( state, other[ 'keys' ][ :size ] ), other[ 'count' ][ :size ], other[ 'mean' ][ :size ], other[ 'm2' ][ :size ] )
+
+    return state
+
+
+# get per key statistics - mergeable count, sum and m2 plus sample stddev matching sql stddev, undefined values returned as none
+def getResults( state ):
+
+    results = {}
+    with np.errstate( invalid='ignore', divide='ignore' ):
+
+        size = state[ 'size' ]
+        count = state[ 'count' ][ :size ]; m2 = state[ 'm2' ][ :size ]
+
+        mean = np.where( count > 0, state[ 'mean' ][ :size ], np.nan )
+        stddev = np.where( count > 1, np.sqrt( m2 / ( count - 1 ) ), np.nan )
+
+        # root mean square recovered from mean and population variance
+        rms = np.where( count > 0, np.sqrt( m2 / count + state[ 'mean' ][ :size ] ** 2 ), np.nan )
+
+    keys = state[ 'keys' ][ :size ].tolist() if size > 0 else []
+    for idx, key in enumerate( keys ):
+
+        results[ key ] = {}
+        for col, name in enumerate( state[ 'names' ] ):
+
+            for stat, values in [ ( 'count', count ), ( 'sum', state[ 'mean' ][ :size ] * count ), ( 'm2', m2 ), ( 'mean', mean ), ( 'stddev', stddev ), ( 'rms', rms ) ]:
+
+                value = values[ idx, col ]
+                results[ key ][ name + '_' + stat ] = None if np.isnan( value ) else float( value )
+
+    return results
+
+
+# stream rows of query through server-side cursor in fixed size batches - first column is group key
+def streamQuery( db, query, params, names, size=100000 ):
+
+    # database driver imported on use - state functions usable without driver
+    import pgsql
+
+    state = getState( names )
+
+    # get connection
+    conn = pgsql.getConnection( db )
+    cur = conn.cursor( name='stream' )
+    cur.itersize = size
+
+    try:
+
+        cur.execute( query, params )
+        while True:
+
+            rows = cur.fetchmany( size )
+            if len( rows ) == 0:
+                break
+
+            keys = [ row[ 0 ] for row in rows ]
+            values = np.array( [ row[ 1: ] for row in rows ], dtype=np.float64 )
+            updateState( state, keys, values )
+
+    # close server-side cursor before returning connection to pool
+    finally:
+        cur.close()
+        conn.rollback()
+        pgsql.releaseConnection( conn )
+
+    return state
+
+
+# aggregate partitioned queries concurrently - partial states merged into single state
+def aggregate( db, queries, names, workers=1, size=100000 ):
+
+    state = getState( names )
+    with ThreadPoolExecutor( max_workers=max( workers, 1 ) ) as executor:
+
+        for partial in executor.map( lambda obj: streamQuery( db, obj[ 0 ], obj[ 1 ], names, size ), queries ):
+            mergeState( state, partial )
+
+    return state
@@ -4,12 +4,18 @@ import os
 import sys
 import math
 import time
+import argparse
 
 import numpy as np
 
 import psycopg2
 from psycopg2.extensions import AsIs
 
+# import shared project functions
+sys.path.insert(0, os.path.join( os.path.dirname( os.path.abspath( __file__ ) ), '../common' ) )
+import pgsql
+import raster
+
 # globals
 schema = 'landcover_poi'
 
@@ -18,18 +24,16 @@ max_samples             = 10000
 default_sample_rate     = 5
 
 # create points of interest
-def getForestPoi():
+def getForestPoi( args ):
 
     # get connection
-    conn = psycopg2.connect("dbname='alps' user='sac' host='localhost' password='sac'")
+    conn = pgsql.getConnection( 'alps' )
     cur = conn.cursor()
 
-    # generate random points inside landcover polygons 
-    query = "CREATE TABLE IF NOT EXISTS %s.forest AS ( " \
-                "WITH polys AS ( SELECT objectid gid, code_18, area_ha, CAST( ( area_ha / %s ) AS INTEGER ) samples, shape FROM ancillary.clc2018_clc2018_v2018_20b " \
-                    "WHERE code_18 = '311' OR code_18 = '312' OR code_18 = '313' AND area_ha > 15 ), " \
-                        "pts AS ( SELECT gid, code_18, area_ha, (ST_Dump( ST_GeneratePoints( shape, LEAST( samples, %s ) ) ) ).geom geom FROM polys ) " \
-                            "SELECT area_ha, geom, ST_NearestValue( rast, 1, geom ) slope FROM ancillary.dem_slope, pts WHERE ST_Intersects( rast, geom ) ); "
+    # generate random points inside landcover polygons - stable integer id carried through sample, result and error tables
+    polys = "WITH polys AS ( SELECT objectid gid, code_18, area_ha, CAST( ( area_ha / %s ) AS INTEGER ) samples, shape FROM ancillary.clc2018_clc2018_v2018_20b " \
+                "WHERE code_18 = '311' OR code_18 = '312' OR code_18 = '313' AND area_ha > 15 ), " \
+                    "pts AS ( SELECT gid, code_18, area_ha, (ST_Dump( ST_GeneratePoints( shape, LEAST( samples, %s ) ) ) ).geom geom FROM polys ) "
 
     try:
 
@@ -37,13 +41,33 @@ def getForestPoi():
         cur.execute( "CREATE SCHEMA IF NOT EXISTS %s;", [ AsIs( schema ) ] ) 
         conn.commit()
 
-        # execute query
-        cur.execute( query, ( AsIs( schema ), AsIs( default_sample_rate ), AsIs( max_samples )  ) )
-        conn.commit()
+        cur.execute( "SELECT to_regclass( %s );", [ schema + '.forest' ] )
+        if cur.fetchone()[ 0 ] is None:
 
-        # execute query        
-        cur.execute( "CREATE INDEX ON %s.forest USING GIST (geom);", [ AsIs( schema ) ] )
-        conn.commit()
+            if args.geotiff is None:
+
+                # slope nearest to point attached from raster table - pixel containing point with points on nodata dropped if requested
+                slope = "ST_Value( rast, 1, geom )" if args.drop_nodata else "ST_NearestValue( rast, 1, geom )"
+                cur.execute( "CREATE TABLE %s.forest AS ( " + polys + \
+                                "SELECT CAST( ROW_NUMBER() OVER () AS INTEGER ) point_id, area_ha, geom, slope FROM " \
+                                    "( SELECT area_ha, geom, %s slope FROM ancillary.dem_slope, pts WHERE ST_Intersects( rast, geom ) ) t WHERE %s ); ",
+                                    ( AsIs( schema ), AsIs( default_sample_rate ), AsIs( max_samples ), 
+                                        AsIs( slope ), AsIs( 'slope IS NOT NULL' if args.drop_nodata else 'TRUE' ) ) )
+
+            else:
+
+                # generated points with coordinates in slope image reference system - pixel containing point sampled in memory
+                cur.execute( "CREATE TABLE %s.forest ( point_id SERIAL, area_ha double precision, geom GEOMETRY, slope double precision );", [ AsIs( schema ) ] )
+                raster.copyPointValues( cur, args.geotiff, polys + "SELECT area_ha, geom, ST_X( ST_Transform( geom, %s ) ), ST_Y( ST_Transform( geom, %s ) ) FROM pts;", 
+                                            ( AsIs( default_sample_rate ), AsIs( max_samples ), args.epsg, args.epsg ), 
+                                                '{}.forest'.format( schema ), [ 'area_ha', 'geom', 'slope' ], drop_nodata=args.drop_nodata )
+
+            conn.commit()
+
+            # execute query        
+            cur.execute( "CREATE INDEX ON %s.forest USING GIST (geom);", [ AsIs( schema ) ] )
+            cur.execute( "CREATE INDEX ON %s.forest ( point_id );", [ AsIs( schema ) ] )
+            conn.commit()
 
     # handle exception
     except psycopg2.Error as e:
@@ -53,12 +77,37 @@ def getForestPoi():
     conn.commit()
     print ( cur.query )
 
-    conn.close()
     cur.close()
+    pgsql.releaseConnection( conn )
 
     return
 
 
-# classify point samples into evergreen / dry tropical
-getForestPoi()
+# parse command line arguments
+def parseArguments(args=None):
 
+    parser = argparse.ArgumentParser(description='alps-poi')
+
+    # optional arguments
+    parser.add_argument('-g', '--geotiff',  
+                        help='slope geotiff sampled in memory instead of ancillary.dem_slope raster table' )
+
+    parser.add_argument('-x', '--drop-nodata',  
+                        help='drop points on slope nodata pixels - by default raster table path takes nearest valid pixel, geotiff path loads null slope',
+                        action='store_true' )
+
+    return parser.parse_args(args)
+
+
+# parse arguments
+args = parseArguments( sys.argv[1:] )
+
+# points transformed into slope image reference system
+if args.geotiff is not None:
+
+    args.epsg = raster.getEpsg( args.geotiff )
+    if args.epsg is None:
+        sys.exit( 'unable to identify epsg of slope geotiff: ' + args.geotiff )
+
+# classify point samples into evergreen / dry tropical
+getForestPoi( args )
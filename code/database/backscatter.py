@@ -4,44 +4,131 @@ import os
 import sys
 import math
 import time
+import io
+import csv
 import argparse
 import psycopg2
 
 import numpy as np
 import datetime as dt
 
-from threading import Thread
+from functools import partial
 from psycopg2.extensions import AsIs
 
+# import shared functions
+sys.path.insert(0, '/sac/bin/util')
+import fio
+import parser
+
+# import shared project functions
+sys.path.insert(0, os.path.join( os.path.dirname( os.path.abspath( __file__ ) ), '../common' ) )
+import pgsql
+import raster
+import scheduler
+
 # landcover types
 landcover_types = { 'forest', 'grassland', 'sugarcane', 'evergreen' }
 
-# insert values into previously created table - use multiple threads configured with different start / end dates
+# get result table name for landcover class
+def getTable( plist, ctype ):
+
+    return plist[ 'product' ] + '_' + ctype
+
+
+# union sample tables of landcover classes sampled in current pass - class label retained
+def getSampleSql( plist, block ):
+
+    return ' UNION ALL '.join( [ "SELECT point_id, geom, '{0}' landcover FROM {1}.{0} WHERE {2}".format( ctype, plist[ 'in_schema' ], block ) for ctype in plist[ 'classes' ] ] )
+
+
+# get sql selecting sample point coordinates in each scene reference system - st_transform returns points already in target srid unchanged
+def getCoordinateSql( epsgs ):
+
+    return ''.join( [ ', ST_X( ST_Transform( geom, {0} ) ), ST_Y( ST_Transform( geom, {0} ) )'.format( epsg ) for epsg in epsgs ] )
+
+
+# get sample point coordinate arrays keyed by epsg - coordinate columns follow offset in retrieved rows
+def getCoordinates( points, epsgs, offset ):
+
+    return { epsg : ( np.array( [ point[ offset + 2 * idx ] for point in points ], dtype=np.float64 ), 
+                        np.array( [ point[ offset + 2 * idx + 1 ] for point in points ], dtype=np.float64 ) ) for idx, epsg in enumerate( epsgs ) }
+
+
+# get epsg codes of scene files of task
+def getTaskEpsg( plist, task, keys ):
+
+    return sorted( set( [ plist[ 'epsg' ][ plist[ key ][ fdate ] ] for key in keys for fdate in task[ 'fdates' ] if fdate in plist[ key ] ] ) )
+
+
+# get column list of paired result tables - values of both algorithms per point and acquisition
+def getPairedColumns( plist ):
+
+    return 'fdate, point_id, {0}_vv, {0}_vh, {1}_vv, {1}_vh, fid'.format( plist[ 'alg' ], plist[ 'pair_alg' ] )
+
+
+# split sampled rows into per class result tables - skip scenes already sampled for block, completion of task scenes recorded in same statement
+def getInsertSql( cur, plist, columns, task ):
+
+    inserts = []
+    for idx, ctype in enumerate( plist[ 'classes' ] ):
+
+        inserts.append( cur.mogrify( "i{0} AS ( INSERT INTO {1}.{2} ( {3} ) SELECT {3} FROM s " \
+                                        "WHERE landcover = %s AND fid <> ALL( %s ) ORDER BY fdate )".format( idx, plist[ 'out_schema' ], getTable( plist, ctype ), columns ), 
+                                            ( ctype, plist[ 'sampled' ][ ctype ][ task[ 'block' ] ] ) ).decode() )
+
+        inserts.append( cur.mogrify( "d{0} AS ( INSERT INTO {1}.{2}_done ( fid, block ) SELECT unnest( %s::integer[] ), %s ON CONFLICT DO NOTHING )".format( idx, plist[ 'out_schema' ], getTable( plist, ctype ) ), 
+                                            ( task[ 'fids' ], task[ 'block' ] ) ).decode() )
+
+    return ', '.join( inserts )
+
+
+# record scenes sampled for block of sample points - executed within transaction writing sampled rows
+def setSampledScenes( cur, plist, fids, block ):
+
+    for ctype in plist[ 'classes' ]:
+        cur.execute( "INSERT INTO %s.%s_done ( fid, block ) SELECT unnest( %s::integer[] ), %s ON CONFLICT DO NOTHING;", 
+                        ( AsIs( plist[ 'out_schema' ] ), AsIs( getTable( plist, ctype ) ), fids, block ) )
+
+    return
+
+
+# get pixel values of algorithm rasters nearest to poi for paired scenes - nodata excluded
+def getPixelSql( plist, alg, key ):
+
+    return "WITH p AS ( SELECT id FROM scene_{0}.product WHERE name = '{1}' ), " \
+                "b1 AS ( SELECT idx FROM scene_{0}.band b, p WHERE b.pid = p.id AND name = 'vv' ), " \
+                    "b2 AS ( SELECT idx FROM scene_{0}.band b, p WHERE b.pid = p.id AND name = 'vh' ), " \
+                        "tile AS ( SELECT cat.fid, cat.fdate, point_id, landcover, rast, ST_NearestValue( rast, b1.idx, geom, false ) vv, ST_NearestValue( rast, b2.idx, geom, false ) vh " \
+                            "FROM scene_{0}.{1} s, scene_{0}.cat cat, lc, pairs, b1, b2 WHERE cat.fid = pairs.{2} AND s.fid = cat.fid AND ST_Intersects( rast, geom ) ) " \
+                                "SELECT fid, fdate, point_id, landcover, vv, vh FROM tile, b1, b2 " \
+                                    "WHERE vv IS NOT NULL AND vh IS NOT NULL AND vv != ST_BandNoDataValue( rast, b1.idx ) AND vh != ST_BandNoDataValue( rast, b2.idx )".format( alg, plist[ 'product' ], key )
+
+
+# insert values into previously created tables - each task covers chunk of scenes and block of sample points
 def populateTable( plist, task ):
 
     # get connection
-    conn = psycopg2.connect("dbname='{}' user='sac' host='localhost' password='sac'".format( plist[ 'db' ] ) )
+    conn = pgsql.getConnection( plist[ 'db' ] )
     cur = conn.cursor()
 
-    # retrieve pixel values nearest to poi for scenes in temporal range
-    query = "INSERT INTO %s.%s ( " \
-                "WITH p AS (SELECT id FROM scene_%s.product WHERE name = '%s'), " \
-                    "b1 AS ( SELECT idx FROM scene_%s.band b, p WHERE b.pid = p.id AND name = 'vv' ), " \
-                        "b2 AS ( SELECT idx FROM scene_%s.band b, p WHERE b.pid = p.id AND name = 'vh' ), " \
-                            "cat AS ( SELECT fid, fdate FROM scene_%s.cat, p WHERE fdate >= '%s' AND fdate <= '%s' AND pid = p.id ), " \
-                                "lc AS ( SELECT geom FROM %s.%s ), " \
-                                    "tile AS ( SELECT cat.fdate, rast, geom, ST_NearestValue( rast, b1.idx, geom, false ) vv, ST_NearestValue( rast, b2.idx, geom, false ) vh FROM scene_%s.%s s, lc, cat, b1, b2 WHERE ST_Intersects( rast, geom ) AND s.fid = cat.fid ) " \
-                                        "SELECT fdate, geom, vv, vh FROM tile, b1, b2 " \
-                                            "WHERE vv IS NOT NULL AND vh IS NOT NULL AND vv != ST_BandNoDataValue( rast, b1.idx ) AND vh != ST_BandNoDataValue( rast, b2.idx ) " \
-                                                "ORDER BY fdate )"
-
-    param_list = ( AsIs( plist[ 'out_schema' ] ), AsIs( plist[ 'table' ] ),
-                        AsIs( plist[ 'alg' ] ), AsIs( plist[ 'product' ] ), 
+    # retrieve pixel values nearest to poi for scenes in temporal range - single pass over rasters for all classes
+    query = "WITH p AS (SELECT id FROM scene_%s.product WHERE name = '%s'), " \
+                "b1 AS ( SELECT idx FROM scene_%s.band b, p WHERE b.pid = p.id AND name = 'vv' ), " \
+                    "b2 AS ( SELECT idx FROM scene_%s.band b, p WHERE b.pid = p.id AND name = 'vh' ), " \
+                        "cat AS ( SELECT fid, fdate FROM scene_%s.cat WHERE fid = ANY( %s ) ), " \
+                            "lc AS ( %s ), " \
+                                "tile AS ( SELECT cat.fid, cat.fdate, rast, point_id, geom, landcover, ST_NearestValue( rast, b1.idx, geom, false ) vv, ST_NearestValue( rast, b2.idx, geom, false ) vh FROM scene_%s.%s s, lc, cat, b1, b2 WHERE ST_Intersects( rast, geom ) AND s.fid = cat.fid ), " \
+                                    "s AS ( SELECT fdate, point_id, geom, vv, vh, fid, landcover FROM tile, b1, b2 " \
+                                        "WHERE vv IS NOT NULL AND vh IS NOT NULL AND vv != ST_BandNoDataValue( rast, b1.idx ) AND vh != ST_BandNoDataValue( rast, b2.idx ) ), " \
+                                            "%s SELECT 1;"
+
+    param_list = ( AsIs( plist[ 'alg' ] ), AsIs( plist[ 'product' ] ), 
+                        AsIs( plist[ 'alg' ] ), 
                             AsIs( plist[ 'alg' ] ), 
-                                AsIs( plist[ 'alg' ] ), 
-                                    AsIs( plist[ 'alg' ] ), AsIs( task[ 'start' ].strftime('%Y-%m-%d %H:%M:%S') ), AsIs( task[ 'end' ].strftime('%Y-%m-%d %H:%M:%S') ), 
-                                        AsIs( plist[ 'in_schema' ] ), AsIs( plist[ 'landcover' ] ), 
-                                            AsIs( plist[ 'alg' ] ), AsIs( plist[ 'product' ] ) )
+                                AsIs( plist[ 'alg' ] ), task[ 'fids' ], 
+                                    AsIs( getSampleSql( plist, task[ 'block' ] ) ), 
+                                        AsIs( plist[ 'alg' ] ), AsIs( plist[ 'product' ] ),
+                                            AsIs( getInsertSql( cur, plist, 'fdate, point_id, geom, vv, vh, fid', task ) ) )
 
     try:
 
@@ -49,22 +136,275 @@ def populateTable( plist, task ):
         cur.execute( query, param_list )        
         conn.commit()
 
-    # handle exception
+    # handle exception - transaction rolled back, raised for retry by scheduler
     except psycopg2.Error as e:
         print ( e.pgerror )    
+        raise
 
     # close connection
-    print ( cur.query )
-    conn.close()
+    finally:
+        print ( cur.query )
+        pgsql.releaseConnection( conn )
+
+    return 
+
+
+# insert paired values of both algorithms into previously created tables - each task covers chunk of scene pairs and block of sample points
+def populatePairedTable( plist, task ):
+
+    # get connection
+    conn = pgsql.getConnection( plist[ 'db' ] )
+    cur = conn.cursor()
+
+    # scenes paired on acquisition datetime - values joined on point id and class rather than geometry, point ids unique within class only
+    query = "WITH pairs AS ( SELECT * FROM unnest( %s::integer[], %s::integer[] ) AS t( fid, pair_fid ) ), " \
+                "lc AS ( %s ), " \
+                    "a AS ( %s ), " \
+                        "b AS ( %s ), " \
+                            "s AS ( SELECT a.fdate, a.point_id, a.landcover, a.vv %s_vv, a.vh %s_vh, b.vv %s_vv, b.vh %s_vh, a.fid FROM pairs " \
+                                "INNER JOIN a ON a.fid = pairs.fid INNER JOIN b ON b.fid = pairs.pair_fid AND b.point_id = a.point_id AND b.landcover = a.landcover ), " \
+                                    "%s SELECT 1;"
+
+    param_list = ( task[ 'fids' ], task[ 'pair_fids' ],
+                        AsIs( getSampleSql( plist, task[ 'block' ] ) ),
+                            AsIs( getPixelSql( plist, plist[ 'alg' ], 'fid' ) ),
+                                AsIs( getPixelSql( plist, plist[ 'pair_alg' ], 'pair_fid' ) ),
+                                    AsIs( plist[ 'alg' ] ), AsIs( plist[ 'alg' ] ), AsIs( plist[ 'pair_alg' ] ), AsIs( plist[ 'pair_alg' ] ),
+                                        AsIs( getInsertSql( cur, plist, getPairedColumns( plist ), task ) ) )
+
+    try:
+
+        # execute query
+        cur.execute( query, param_list )        
+        conn.commit()
+
+    # handle exception - transaction rolled back, raised for retry by scheduler
+    except psycopg2.Error as e:
+        print ( e.pgerror )    
+        raise
+
+    # close connection
+    finally:
+        print ( cur.query )
+        pgsql.releaseConnection( conn )
 
     return 
 
 
-# create table ready to populate
-def createTable( plist ):
+# insert paired values of both algorithms into previously created tables - pixels read directly from ingested scene files
+def samplePairedScenes( plist, task ):
+
+    # get connection
+    conn = pgsql.getConnection( plist[ 'db' ] )
+    cur = conn.cursor()
+
+    try:
+
+        # retrieve sample point ids of all classes with coordinates in reference system of each scene file
+        epsgs = getTaskEpsg( plist, task, [ 'files', 'pair_files' ] )
+        cur.execute( "SELECT point_id, landcover%s FROM ( %s ) t;", ( AsIs( getCoordinateSql( epsgs ) ), AsIs( getSampleSql( plist, task[ 'block' ] ) ) ) )
+        points = cur.fetchall()
+
+        coords = getCoordinates( points, epsgs, 2 )
+
+        # split rows into per class buffers
+        buffers = { ctype : io.StringIO() for ctype in plist[ 'classes' ] }
+        writers = { ctype : csv.writer( buffers[ ctype ] ) for ctype in plist[ 'classes' ] }
+        sampled = { ctype : set( plist[ 'sampled' ][ ctype ][ task[ 'block' ] ] ) for ctype in plist[ 'classes' ] }
+
+        # for each scene pair in task
+        fids = []
+        for fid, fdate in zip( task[ 'fids' ], task[ 'fdates' ] ):
+
+            pathname = plist[ 'files' ].get( fdate )
+            pair_pathname = plist[ 'pair_files' ].get( fdate )
+
+            if pathname is None or pair_pathname is None:
+                print ( '... no scene file pair found for: {}'.format( fdate ) )
+                continue
+
+            fids.append( fid )
+
+            # vv / vh values of both algorithms at pixels containing points - exclude nodata in either
+            values = np.hstack( [ raster.samplePoints( pathname, [ plist[ 'bands' ][ 'vv' ], plist[ 'bands' ][ 'vh' ] ], *coords[ plist[ 'epsg' ][ pathname ] ] ),
+                                    raster.samplePoints( pair_pathname, [ plist[ 'pair_bands' ][ 'vv' ], plist[ 'pair_bands' ][ 'vh' ] ], *coords[ plist[ 'epsg' ][ pair_pathname ] ] ) ] )
+
+            for idx in np.flatnonzero( ~np.isnan( values ).any( axis=1 ) ):
+
+                # skip scenes already sampled in incremental mode
+                ctype = points[ idx ][ 1 ]
+                if fid not in sampled[ ctype ]:
+                    writers[ ctype ].writerow( [ fdate, points[ idx ][ 0 ] ] + values[ idx ].tolist() + [ fid ] )
+
+        # bulk load rows 
+        for ctype in plist[ 'classes' ]:
+
+            buffers[ ctype ].seek( 0 )
+            cur.copy_expert( "COPY {}.{} ( {} ) FROM STDIN WITH CSV".format( plist[ 'out_schema' ], getTable( plist, ctype ), getPairedColumns( plist ) ), buffers[ ctype ] )
+
+        # scenes without files left unrecorded - retried on next incremental run
+        setSampledScenes( cur, plist, fids, task[ 'block' ] )
+        conn.commit()
+
+    # handle exception - transaction rolled back, raised for retry by scheduler
+    except psycopg2.Error as e:
+        print ( e.pgerror )    
+        raise
+
+    # close connection
+    finally:
+        pgsql.releaseConnection( conn )
+
+    return 
+
+
+# insert values into previously created table - pixels read directly from ingested scene files
+def sampleScenes( plist, task ):
+
+    # get connection
+    conn = pgsql.getConnection( plist[ 'db' ] )
+    cur = conn.cursor()
+
+    try:
+
+        # retrieve sample points of all classes with coordinates in reference system of each scene file - geometry kept as ewkb for copy
+        epsgs = getTaskEpsg( plist, task, [ 'files' ] )
+        cur.execute( "SELECT geom, landcover, point_id%s FROM ( %s ) t;", ( AsIs( getCoordinateSql( epsgs ) ), AsIs( getSampleSql( plist, task[ 'block' ] ) ) ) )
+        points = cur.fetchall()
+
+        coords = getCoordinates( points, epsgs, 3 )
+
+        # split rows into per class buffers
+        buffers = { ctype : io.StringIO() for ctype in plist[ 'classes' ] }
+        writers = { ctype : csv.writer( buffers[ ctype ] ) for ctype in plist[ 'classes' ] }
+        sampled = { ctype : set( plist[ 'sampled' ][ ctype ][ task[ 'block' ] ] ) for ctype in plist[ 'classes' ] }
+
+        # for each scene in task
+        fids = []
+        for fid, fdate in zip( task[ 'fids' ], task[ 'fdates' ] ):
+
+            pathname = plist[ 'files' ].get( fdate )
+            if pathname is None:
+                print ( '... no scene file found for: {}'.format( fdate ) )
+                continue
+
+            fids.append( fid )
+
+            # vv / vh values at pixels containing points - exclude nodata
+            values = raster.samplePoints( pathname, [ plist[ 'bands' ][ 'vv' ], plist[ 'bands' ][ 'vh' ] ], *coords[ plist[ 'epsg' ][ pathname ] ] )
+            for idx in np.flatnonzero( ~np.isnan( values ).any( axis=1 ) ):
+
+                # skip scenes already sampled in incremental mode
+                ctype = points[ idx ][ 1 ]
+                if fid not in sampled[ ctype ]:
+                    writers[ ctype ].writerow( [ fdate, points[ idx ][ 2 ], points[ idx ][ 0 ], values[ idx, 0 ], values[ idx, 1 ], fid ] )
+
+        # bulk load rows 
+        for ctype in plist[ 'classes' ]:
+
+            buffers[ ctype ].seek( 0 )
+            cur.copy_expert( "COPY {}.{} ( fdate, point_id, geom, vv, vh, fid ) FROM STDIN WITH CSV".format( plist[ 'out_schema' ], getTable( plist, ctype ) ), buffers[ ctype ] )
+
+        # scenes without files left unrecorded - retried on next incremental run
+        setSampledScenes( cur, plist, fids, task[ 'block' ] )
+        conn.commit()
+
+    # handle exception - transaction rolled back, raised for retry by scheduler
+    except psycopg2.Error as e:
+        print ( e.pgerror )    
+        raise
+
+    # close connection
+    finally:
+        pgsql.releaseConnection( conn )
+
+    return 
+
+
+# get ingested scene files keyed on acquisition datetime
+def getSceneFiles( plist, args ):
+
+    files = {}
+    for pathname in fio.getFileList( plist[ 'product' ] + '.vrt', args.path ):
+
+        # gamma and snap products share file names - select algorithm sub-folder
+        if os.sep + plist[ 'alg' ] + os.sep in pathname:
+            files[ parser.getDateTime( pathname ) ] = pathname
+
+    return files
+
+
+# get epsg code of each scene file - points transformed into scene reference system before pixel lookup
+def getSceneEpsg( pathnames ):
+
+    epsg = {}
+    for pathname in pathnames:
+
+        epsg[ pathname ] = raster.getEpsg( pathname )
+        if epsg[ pathname ] is None:
+            sys.exit( 'unable to identify epsg of scene file: ' + pathname )
+
+    return epsg
+
+
+# get distinct srids of sample points of all classes
+def getSampleSrids( plist ):
+
+    srids = []
+
+    # get connection
+    conn = pgsql.getConnection( plist[ 'db' ] )
+    cur = conn.cursor()
+
+    try:
+
+        # execute query
+        cur.execute( "SELECT DISTINCT ST_SRID( geom ) FROM ( %s ) t;", [ AsIs( getSampleSql( plist, 'TRUE' ) ) ] )
+        srids = [ row[ 0 ] for row in cur.fetchall() ]
+
+    # handle exception
+    except psycopg2.Error as e:
+        print ( e.pgerror )    
+
+    # close connection
+    pgsql.releaseConnection( conn )
+
+    return srids
+
+
+# get raster band indices of vv and vh polarisations
+def getBandIndex( plist ):
+
+    bands = {}
+
+    # get connection
+    conn = pgsql.getConnection( plist[ 'db' ] )
+    cur = conn.cursor()
+
+    try:
+
+        # execute query
+        cur.execute( "SELECT b.name, b.idx FROM scene_%s.band b INNER JOIN scene_%s.product p ON b.pid = p.id WHERE p.name = %s;",
+                        ( AsIs( plist[ 'alg' ] ), AsIs( plist[ 'alg' ] ), plist[ 'product' ] ) )
+        bands = dict( cur.fetchall() )
+
+    # handle exception
+    except psycopg2.Error as e:
+        print ( e.pgerror )    
+
+    # close connection
+    pgsql.releaseConnection( conn )
+
+    return bands
+
+
+# create table ready to populate - existing table retained in incremental mode
+def createTable( plist, ctype, incremental=False ):
+
+    table = getTable( plist, ctype )
 
     # get connection
-    conn = psycopg2.connect("dbname='{}' user='sac' host='localhost' password='sac'".format( plist[ 'db' ] ) )
+    conn = pgsql.getConnection( plist[ 'db' ] )
     cur = conn.cursor()
 
     try:
@@ -74,12 +414,76 @@ def createTable( plist ):
         conn.commit()
 
         # delete sample table if not exists
-        cur.execute( "DROP TABLE IF EXISTS %s.%s;" , ( AsIs( plist[ 'out_schema' ] ), AsIs( plist[ 'table' ] ) ) )
-        conn.commit()
+        if not incremental:
+            cur.execute( "DROP TABLE IF EXISTS %s.%s, %s.%s_done;" , ( AsIs( plist[ 'out_schema' ] ), AsIs( table ), AsIs( plist[ 'out_schema' ] ), AsIs( table ) ) )
+            conn.commit()
+
+        # paired table holds values of both algorithms - fid identifies scene of first algorithm
+        columns = "fdate TIMESTAMP, point_id INTEGER, geom GEOMETRY, vv double precision, vh double precision, fid INTEGER"
+        if 'pair_alg' in plist:
+            columns = "fdate TIMESTAMP, point_id INTEGER, {0}_vv double precision, {0}_vh double precision, {1}_vv double precision, {1}_vh double precision, fid INTEGER".format( plist[ 'alg' ], plist[ 'pair_alg' ] )
 
         # delete sample table if not exists
-        cur.execute( "CREATE TABLE IF NOT EXISTS %s.%s ( fdate TIMESTAMP, geom GEOMETRY, vv double precision, vh double precision );" , 
-                ( AsIs( plist[ 'out_schema' ] ), AsIs( plist[ 'table' ] ) ) )
+        cur.execute( "CREATE TABLE IF NOT EXISTS %s.%s ( %s );" , 
+                ( AsIs( plist[ 'out_schema' ] ), AsIs( table ), AsIs( columns ) ) )
+        conn.commit()
+
+        if incremental and 'pair_alg' not in plist:
+
+            # tables created before scene ids were recorded - backfill from catalogue
+            cur.execute( "ALTER TABLE %s.%s ADD COLUMN IF NOT EXISTS fid INTEGER;", ( AsIs( plist[ 'out_schema' ] ), AsIs( table ) ) )
+            cur.execute( "UPDATE %s.%s r SET fid = c.fid FROM scene_%s.cat c, scene_%s.product p " \
+                            "WHERE r.fid IS NULL AND r.fdate = c.fdate AND c.pid = p.id AND p.name = %s;",
+                                ( AsIs( plist[ 'out_schema' ] ), AsIs( table ), AsIs( plist[ 'alg' ] ), AsIs( plist[ 'alg' ] ), plist[ 'product' ] ) )
+
+            # tables created before point ids were recorded - one-off backfill from sample table
+            cur.execute( "ALTER TABLE %s.%s ADD COLUMN IF NOT EXISTS point_id INTEGER;", ( AsIs( plist[ 'out_schema' ] ), AsIs( table ) ) )
+            cur.execute( "UPDATE %s.%s r SET point_id = p.point_id FROM %s.%s p WHERE r.point_id IS NULL AND ST_Equals( r.geom, p.geom );",
+                            ( AsIs( plist[ 'out_schema' ] ), AsIs( table ), AsIs( plist[ 'in_schema' ] ), AsIs( ctype ) ) )
+
+        # completion of each scene and spatial block recorded alongside sampled rows
+        cur.execute( "SELECT to_regclass( %s );", [ '{}.{}_done'.format( plist[ 'out_schema' ], table ) ] )
+        if cur.fetchone()[ 0 ] is None:
+
+            cur.execute( "CREATE TABLE %s.%s_done ( fid INTEGER, block TEXT, PRIMARY KEY ( fid, block ) );", ( AsIs( plist[ 'out_schema' ] ), AsIs( table ) ) )
+
+            # result tables sampled before completion was recorded - scenes present treated as complete
+            cur.execute( "INSERT INTO %s.%s_done SELECT DISTINCT fid, 'TRUE' FROM %s.%s WHERE fid IS NOT NULL;", 
+                            ( AsIs( plist[ 'out_schema' ] ), AsIs( table ), AsIs( plist[ 'out_schema' ] ), AsIs( table ) ) )
+            conn.commit()
+
+        if incremental:
+
+            cur.execute( "CREATE INDEX IF NOT EXISTS %s_fid_idx ON %s.%s ( fid );", 
+                            ( AsIs( table ), AsIs( plist[ 'out_schema' ] ), AsIs( table ) ) )
+            conn.commit()
+
+    # handle exception
+    except psycopg2.Error as e:
+        print ( e.pgerror )    
+
+    # close connection
+    print ( cur.query )
+    pgsql.releaseConnection( conn )
+
+    return 
+
+
+# create point id index on populated table - built after bulk load, maintained thereafter
+def createIndex( plist, ctype ):
+
+    table = getTable( plist, ctype )
+
+    # get connection
+    conn = pgsql.getConnection( plist[ 'db' ] )
+    cur = conn.cursor()
+
+    try:
+
+        # execute query
+        cur.execute( "CREATE INDEX IF NOT EXISTS %s_point_id_idx ON %s.%s ( point_id, fdate );", 
+                        ( AsIs( table ), AsIs( plist[ 'out_schema' ] ), AsIs( table ) ) )
+        cur.execute( "ANALYZE %s.%s;", ( AsIs( plist[ 'out_schema' ] ), AsIs( table ) ) )
         conn.commit()
 
     # handle exception
@@ -88,11 +492,88 @@ def createTable( plist ):
 
     # close connection
     print ( cur.query )
-    conn.close()
+    pgsql.releaseConnection( conn )
 
     return 
 
 
+# check sample table carries point ids assigned at poi generation - ids never assigned here
+def hasPointIds( plist, ctype ):
+
+    exists = False
+
+    # get connection
+    conn = pgsql.getConnection( plist[ 'db' ] )
+    cur = conn.cursor()
+
+    try:
+
+        # execute query
+        cur.execute( "SELECT 1 FROM information_schema.columns WHERE table_schema = %s AND table_name = %s AND column_name = 'point_id';", ( plist[ 'in_schema' ], ctype ) )
+        exists = cur.fetchone() is not None
+
+    # handle exception
+    except psycopg2.Error as e:
+        print ( e.pgerror )    
+
+    # close connection
+    pgsql.releaseConnection( conn )
+
+    return exists
+
+
+# get scene ids sampled per class and spatial block - empty unless incremental
+def getSampledScenes( plist, incremental=False ):
+
+    sampled = { ctype : { block : set() for block in plist[ 'blocks' ] } for ctype in plist[ 'classes' ] }
+    stale = set()
+
+    if incremental:
+
+        # get connection
+        conn = pgsql.getConnection( plist[ 'db' ] )
+        cur = conn.cursor()
+
+        try:
+
+            # execute query per result table
+            for ctype in plist[ 'classes' ]:
+
+                cur.execute( "SELECT fid, block FROM %s.%s_done;", ( AsIs( plist[ 'out_schema' ] ), AsIs( getTable( plist, ctype ) ) ) )
+                for fid, block in cur.fetchall():
+
+                    # scenes sampled in single block cover every block
+                    if block == 'TRUE':
+                        for obj in sampled[ ctype ].values():
+                            obj.add( fid )
+
+                    elif block in sampled[ ctype ]:
+                        sampled[ ctype ][ block ].add( fid )
+
+                    else:
+                        stale.add( fid )
+
+        # handle exception
+        except psycopg2.Error as e:
+            print ( e.pgerror )    
+
+        # close connection
+        pgsql.releaseConnection( conn )
+
+    # scenes sampled for every block of every class
+    complete = set.intersection( *[ obj for ctype in sampled for obj in sampled[ ctype ].values() ] )
+
+    # partially sampled under different block layout - resampling current blocks would duplicate rows
+    stale -= complete
+    if len( stale ) > 0:
+
+        print ( '... {} scenes partially sampled with different block layout - rerun with original blocks to complete'.format( len( stale ) ) )
+        complete |= stale
+
+    # lists adapt to sql arrays
+    return { ctype : { block : sorted( sampled[ ctype ][ block ] | stale ) for block in sampled[ ctype ] } for ctype in sampled }, sorted( complete )
+
+
 # get date time object
 def getDateTime( arg ):
 
@@ -109,7 +590,7 @@ def getSceneRange( plist ):
     rows = None
 
     # get connection
-    conn = psycopg2.connect("dbname='{}' user='sac' host='localhost' password='sac'".format( plist[ 'db' ] ) )
+    conn = pgsql.getConnection( plist[ 'db' ] )
     cur = conn.cursor()
 
     # construct query
@@ -126,7 +607,7 @@ def getSceneRange( plist ):
 
     # close connection
     print ( cur.query )
-    conn.close()
+    pgsql.releaseConnection( conn )
 
     return rows[ 0 ]
 
@@ -151,22 +632,145 @@ def getDateTimeRange( plist, args ):
     return start_dt, end_dt
 
 
-# get scene temporal range
+# get scenes in temporal range with raster tile count - scenes sampled for every block excluded
+def getSceneTiles( plist, start_dt, end_dt, complete=[] ):
+
+    rows = []
+
+    # get connection
+    conn = pgsql.getConnection( plist[ 'db' ] )
+    cur = conn.cursor()
+
+    # construct query
+    query = "WITH p AS ( SELECT id FROM scene_%s.product WHERE name = '%s' ) " \
+                "SELECT c.fid, c.fdate, COUNT(*) FROM scene_%s.cat c INNER JOIN scene_%s.%s s ON s.fid = c.fid, p " \
+                    "WHERE c.pid = p.id AND c.fdate >= %s AND c.fdate <= %s AND c.fid <> ALL( %s ) GROUP BY c.fid, c.fdate ORDER BY c.fdate"
+
+    param_list = ( AsIs( plist[ 'alg' ] ), AsIs( plist[ 'product' ] ), 
+                        AsIs( plist[ 'alg' ] ), AsIs( plist[ 'alg' ] ), AsIs( plist[ 'product' ] ), 
+                            start_dt, end_dt, complete )
+
+    try:
+
+        # execute query
+        cur.execute( query, param_list )
+        rows = cur.fetchall()
+        
+    # handle exception
+    except psycopg2.Error as e:
+        print ( e.pgerror )    
+
+    # close connection
+    print ( cur.query )
+    pgsql.releaseConnection( conn )
+
+    return rows
+
+
+# get scene pairs of both algorithms acquired at same datetime with combined raster tile count - pairs sampled for every block excluded
+def getScenePairs( plist, start_dt, end_dt, complete=[] ):
+
+    rows = []
+
+    # get connection
+    conn = pgsql.getConnection( plist[ 'db' ] )
+    cur = conn.cursor()
+
+    # construct query
+    query = "WITH a AS ( SELECT c.fid, c.fdate, COUNT(*) tiles FROM scene_{0}.cat c INNER JOIN scene_{0}.{2} s ON s.fid = c.fid INNER JOIN scene_{0}.product p ON c.pid = p.id " \
+                "WHERE p.name = '{2}' AND c.fdate >= %s AND c.fdate <= %s GROUP BY c.fid, c.fdate ), " \
+                    "b AS ( SELECT c.fid, c.fdate, COUNT(*) tiles FROM scene_{1}.cat c INNER JOIN scene_{1}.{2} s ON s.fid = c.fid INNER JOIN scene_{1}.product p ON c.pid = p.id " \
+                        "WHERE p.name = '{2}' AND c.fdate >= %s AND c.fdate <= %s GROUP BY c.fid, c.fdate ) " \
+                            "SELECT a.fid, a.fdate, a.tiles + b.tiles, b.fid FROM a INNER JOIN b ON a.fdate = b.fdate WHERE a.fid <> ALL( %s ) ORDER BY a.fdate".format( plist[ 'alg' ], plist[ 'pair_alg' ], plist[ 'product' ] )
+
+    try:
+
+        # execute query
+        cur.execute( query, ( start_dt, end_dt, start_dt, end_dt, complete ) )
+        rows = cur.fetchall()
+        
+    # handle exception
+    except psycopg2.Error as e:
+        print ( e.pgerror )    
+
+    # close connection
+    print ( cur.query )
+    pgsql.releaseConnection( conn )
+
+    return rows
+
+
+# get spatial blocks partitioning sample points into vertical strips
+def getBlockList( plist, blocks ):
+
+    block_list = [ 'TRUE' ]
+    if blocks > 1:
+
+        # get connection
+        conn = pgsql.getConnection( plist[ 'db' ] )
+        cur = conn.cursor()
+
+        try:
+
+            # retrieve sample extent
+            cur.execute( "SELECT ST_XMin( e ), ST_XMax( e ) FROM ( SELECT ST_Extent( geom ) e FROM ( %s ) t ) u;", 
+                            ( AsIs( getSampleSql( plist, 'TRUE' ) ), ) )
+            xmin, xmax = cur.fetchone()
+
+            if xmin is not None:
+
+                # half open strips - last strip closed to include points on eastern edge
+                width = ( xmax - xmin ) / blocks
+                block_list = [ 'ST_X( geom ) >= {} AND ST_X( geom ) < {}'.format( xmin + idx * width, xmin + ( idx + 1 ) * width ) for idx in range( blocks - 1 ) ]
+                block_list.append( 'ST_X( geom ) >= {}'.format( xmin + ( blocks - 1 ) * width ) )
+
+        # handle exception
+        except psycopg2.Error as e:
+            print ( e.pgerror )    
+
+        # close connection
+        pgsql.releaseConnection( conn )
+
+    return block_list
+
+
+# partition scenes into chunks of similar raster tile count - several chunks per thread so idle threads pick up remaining work
 def getTaskList( plist, args ):
 
     # get scene temporal range
     start_dt, end_dt = getDateTimeRange( plist, args )
+    if 'pair_alg' in plist:
+        scenes = getScenePairs( plist, start_dt, end_dt, plist[ 'complete' ] )
+    else:
+        scenes = [ row + ( None, ) for row in getSceneTiles( plist, start_dt, end_dt, plist[ 'complete' ] ) ]
+
+    print ( '... {} scenes to sample'.format( len( scenes ) ) )
+
+    block_list = plist[ 'blocks' ]
+
+    # target tile count per chunk
+    total = sum( [ scene[ 2 ] for scene in scenes ] )
+    chunks = max( 1, ( args.threads * args.chunks ) // len( block_list ) )
+    target = total / chunks
 
-    interval = ( end_dt.timestamp() - start_dt.timestamp() ) / args.threads
-    next = start_dt.timestamp()
+    tasklist = []; fids = []; fdates = []; pair_fids = []; count = 0
+    for fid, fdate, tiles, pair_fid in scenes:
 
-    tasklist = []; index = 0
-    while next < end_dt.timestamp():
+        fids.append( fid ); fdates.append( fdate ); pair_fids.append( pair_fid ); count += tiles
+        if count >= target:
+            tasklist.append( { 'fids' : fids, 'fdates' : fdates, 'pair_fids' : pair_fids, 'tiles' : count } )
+            fids = []; fdates = []; pair_fids = []; count = 0
 
-        tasklist.append ( { 'index' : index, 'start' : dt.datetime.fromtimestamp( next ), 'end' : dt.datetime.fromtimestamp( next + interval ) } )
+    if len( fids ) > 0:
+        tasklist.append( { 'fids' : fids, 'fdates' : fdates, 'pair_fids' : pair_fids, 'tiles' : count } )
 
-        next = next + interval + 1
-        index = index + 1
+    # cross scene chunks with spatial blocks
+    tasklist = [ dict( task, block=block ) for task in tasklist for block in block_list ]
+
+    # largest chunks first
+    tasklist = sorted( tasklist, key=lambda task: task[ 'tiles' ], reverse=True )
+    for index, task in enumerate( tasklist ):
+        task[ 'index' ] = index
 
     return tasklist
 
@@ -203,9 +807,45 @@ def parseArguments(args=None):
 
     parser.add_argument('-n', '--threads',  
                         type=int,
-                        help='number of threads',
+                        help='maximum number of concurrent database sessions',
+                        default=1 )
+
+    parser.add_argument('-r', '--retries',  
+                        type=int,
+                        help='number of retries per task on transient database errors',
+                        default=3 )
+
+    parser.add_argument('-i', '--incremental',  
+                        help='append scenes not yet present in result tables',
+                        action='store_true' )
+
+    parser.add_argument('-u', '--union',  
+                        help='sample all landcover classes in single pass over rasters',
+                        action='store_true' )
+
+    parser.add_argument('-f', '--fused',  
+                        help='sample first two algorithms in single job into paired result tables',
+                        action='store_true' )
+
+    parser.add_argument('-b', '--blocks',  
+                        type=int,
+                        help='number of spatial blocks partitioning sample points',
                         default=1 )
 
+    parser.add_argument('-k', '--chunks',  
+                        type=int,
+                        help='number of scene chunks queued per thread',
+                        default=4 )
+
+    parser.add_argument('-e', '--engine',  
+                        help='sampling engine (postgis, gdal)',
+                        choices=[ 'postgis', 'gdal' ],
+                        default='postgis' )
+
+    parser.add_argument('-p', '--path',  
+                        help='root path of ingested scene files (gdal engine)',
+                        default='/data/ard/fiji' )
+
     parser.add_argument('-g', '--alg',  
                         nargs='+',                     
                         help='algorithm options',
@@ -220,40 +860,90 @@ def parseArguments(args=None):
 
 # parse arguments
 args = parseArguments( sys.argv[1:] )
+
+# pooled connection per concurrent thread plus main thread
+pgsql.max_connections = max( pgsql.max_connections, args.threads + 1 )
+
 plist = { 'orbit' : args.orbit.upper(), 'product' : args.product, 'db' : args.database, 'in_schema' : 'sample' }
 
 if len ( args.slope ) > 0:
     plist[ 'in_schema' ] += '_' + args.slope
 
+# fused mode pairs first two algorithms - otherwise one pass per algorithm
+alg_list = [ [ alg ] for alg in args.alg ]
+if args.fused:
+
+    if len( args.alg ) != 2:
+        sys.exit( 'fused sampling requires two algorithms' )
+
+    alg_list = [ args.alg ]
+
 # for each algorithm
-for alg in args.alg:
+failures = 0
+for algs in alg_list:
 
     # initialise schema
-    plist[ 'alg' ] = alg
-    plist[ 'out_schema' ] = plist[ 'in_schema' ].replace( 'sample', 'result' ) + '_' + alg
+    plist[ 'alg' ] = algs[ 0 ]
+    plist[ 'out_schema' ] = plist[ 'in_schema' ].replace( 'sample', 'result' ) + '_' + algs[ 0 ]
+
+    func = populateTable
+    if len( algs ) > 1:
+
+        # paired values of both algorithms written to shared schema
+        plist[ 'pair_alg' ] = algs[ 1 ]
+        plist[ 'out_schema' ] = plist[ 'in_schema' ].replace( 'sample', 'result' ) + '_paired'
+        func = populatePairedTable
+
+    # gdal engine reads ingested scene files directly
+    if args.engine == 'gdal':
+
+        func = samplePairedScenes if len( algs ) > 1 else sampleScenes
+        plist[ 'bands' ] = getBandIndex( plist )
+        plist[ 'files' ] = getSceneFiles( plist, args )
+
+        if len( algs ) > 1:
+            plist[ 'pair_bands' ] = getBandIndex( dict( plist, alg=algs[ 1 ] ) )
+            plist[ 'pair_files' ] = getSceneFiles( dict( plist, alg=algs[ 1 ] ), args )
+
+        plist[ 'epsg' ] = getSceneEpsg( list( plist[ 'files' ].values() ) + list( plist.get( 'pair_files', {} ).values() ) )
+
+    # single pass over rasters for all landcover classes - or one pass per class
+    classes = [ ctype for ctype in landcover_types if ctype in args.landcover ]
+    passes = [ classes ] if args.union else [ [ ctype ] for ctype in classes ]
+
+    for pass_classes in passes:
+
+        plist[ 'classes' ] = pass_classes
+        for ctype in pass_classes:
 
-    # for each landcover class 
-    for ctype in landcover_types:
+            # point ids must match poi tables - regenerate samples rather than number rows here
+            if not hasPointIds( plist, ctype ):
+                sys.exit( 'sample table {}.{} has no point_id column - regenerate with sample.py'.format( plist[ 'in_schema' ], ctype ) )
 
-        if ctype in args.landcover:
+            createTable( plist, ctype, args.incremental )
 
-            plist[ 'landcover' ] = ctype
-            plist[ 'table' ] = plist[ 'product' ] + '_' + ctype
+        # sample points without reference system cannot be transformed into scene reference system
+        if args.engine == 'gdal' and 0 in getSampleSrids( plist ):
+            sys.exit( 'sample points without srid in {} - unable to transform into scene reference system'.format( plist[ 'in_schema' ] ) )
 
-            # construct tasklist and result array
-            createTable( plist )
-            tasklist = getTaskList( plist, args )
+        # construct tasklist - scenes resumed per spatial block
+        plist[ 'blocks' ] = getBlockList( plist, args.blocks )
+        plist[ 'sampled' ], plist[ 'complete' ] = getSampledScenes( plist, args.incremental )
+        tasklist = getTaskList( plist, args )
 
-            # create thread per task (sub-query)
-            threads = []
-            for task in tasklist:
+        # bounded pool of threads - largest chunks first, idle threads pick up remaining chunks
+        results = scheduler.runThreads( partial( func, dict( plist ) ), tasklist, 
+                                            threads=args.threads, retries=args.retries, transient=psycopg2.OperationalError, 
+                                            weight=lambda task: task[ 'tiles' ] )
 
-                # We start one thread per url present.
-                process = Thread(target=populateTable, args=[ plist, task ] )
-                process.start()
-                threads.append(process)
+        scheduler.printSummary( results, label=lambda task: 'task {:>4} - {} scenes'.format( task[ 'index' ], len( task[ 'fids' ] ) ) )
+        failures += len( [ result for result in results if result[ 'status' ] != 'ok' ] )
 
-            # pause main thread until all child threads complete
-            for process in threads:
-                process.join()
+        # integer point id joins downstream
+        for ctype in pass_classes:
+            createIndex( plist, ctype )
 
+# failed tasks leave result tables incomplete
+if failures > 0:
+    print ( '... {} tasks failed - result tables incomplete'.format( failures ) )
+    sys.exit( 1 )
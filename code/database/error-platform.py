@@ -12,6 +12,11 @@ import datetime as dt
 
 from psycopg2.extensions import AsIs
 
+# import shared project functions
+sys.path.insert(0, os.path.join( os.path.dirname( os.path.abspath( __file__ ) ), '../common' ) )
+import pgsql
+import pairs
+
 # landcover classes
 landcover_types = { 'forest', 'grassland', 'sugarcane', 'evergreen' }
 
@@ -19,32 +24,29 @@ landcover_types = { 'forest', 'grassland', 'sugarcane', 'evergreen' }
 def populateTable( plist ):
 
     # get connection
-    conn = psycopg2.connect("dbname='{}' user='sac' host='localhost' password='sac'".format( plist[ 'db' ] ) )
+    conn = pgsql.getConnection( plist[ 'db' ] )
     cur = conn.cursor()
 
     # construct subfilter and table name
-    subfilter = "filename LIKE '{}%%'".format(  plist[ 'platform' ] )
+    subfilter = "filename LIKE '{}%'".format(  plist[ 'platform' ] )
     table = plist[ 'product' ] + '_' + plist[ 'landcover' ]
 
     # optional orbital direction filter
     if plist[ 'orbit' ] == 'ASCENDING' or plist[ 'orbit' ] == 'DESCENDING':   
-        subfilter += " AND orbitdirection = '%s'"
+        subfilter += " AND orbitdirection = '{}'".format( plist[ 'orbit' ] )
         table += '_' + plist[ 'orbit' ]
 
-    # join gamma and snap result tables - compute error statistics
+    # compute error statistics from shared paired sample table
     query = "CREATE TABLE IF NOT EXISTS %s.%s AS ( " \
                 "WITH pts AS ( " \
-                    "SELECT a.fdate, ST_AsText(a.geom) geom, a.vv gamma_vv, a.vh gamma_vh, b.vv snap_vv, b.vh snap_vh, a.vv-b.vv vv_error, a.vh-b.vh vh_error, c.filename, c.orbitdirection, c.relativeorbitnumber FROM %s_gamma.%s_%s a " \
-                        "INNER JOIN %s_snap.%s_%s b ON a.fdate = b.fdate AND ST_Equals( a.geom, b.geom ) " \
-                            "INNER JOIN meta c ON a.fdate = c.fdate ) " \
-                                "SELECT geom, avg(gamma_vv) gamma_vv_mean, stddev(gamma_vv) gamma_vv_stddev, avg( gamma_vh ) gamma_vh_mean, stddev( gamma_vh) gamma_vh_stddev, avg( snap_vv ) snap_vv_mean, stddev( snap_vv ) snap_vv_stddev, avg( snap_vh ) snap_vh_mean, stddev( snap_vh ) snap_vh_stddev, avg(vv_error) vv_error_mean, stddev( vv_error ) vv_error_stddev, avg( vh_error ) vh_error_mean, stddev( vh_error) vh_error_stddev  " \
-                                    "FROM pts WHERE %s GROUP BY geom );"
+                    "SELECT fdate, point_id, gamma_vv, gamma_vh, snap_vv, snap_vh, gamma_vv-snap_vv vv_error, gamma_vh-snap_vh vh_error FROM %s WHERE %s ), " \
+                        "stats AS ( SELECT point_id, avg(gamma_vv) gamma_vv_mean, stddev(gamma_vv) gamma_vv_stddev, avg( gamma_vh ) gamma_vh_mean, stddev( gamma_vh) gamma_vh_stddev, avg( snap_vv ) snap_vv_mean, stddev( snap_vv ) snap_vv_stddev, avg( snap_vh ) snap_vh_mean, stddev( snap_vh ) snap_vh_stddev, avg(vv_error) vv_error_mean, stddev( vv_error ) vv_error_stddev, avg( vh_error ) vh_error_mean, stddev( vh_error) vh_error_stddev  " \
+                            "FROM pts GROUP BY point_id ) " \
+                                "SELECT ST_AsText( p.geom ) geom, s.* FROM stats s INNER JOIN %s.%s p ON p.point_id = s.point_id );"
 
     param_list = ( AsIs( plist[ 'out_schema' ] ), AsIs( table ),
-                        AsIs( plist[ 'in_schema' ] ), AsIs( plist[ 'product' ] ), AsIs( plist[ 'landcover' ] ), 
-                            AsIs( plist[ 'in_schema' ] ), AsIs( plist[ 'product' ] ), AsIs( plist[ 'landcover' ] ),
-                                AsIs( subfilter ) )
-
+                        AsIs( pairs.getTable( plist ) ), AsIs( subfilter ),
+                            AsIs( plist[ 'sample_schema' ] ), AsIs( plist[ 'landcover' ] ) )
 
     try:
 
@@ -56,13 +58,17 @@ def populateTable( plist ):
         cur.execute( query, param_list )        
         conn.commit()
 
+        # point id index supports joins between error tables
+        cur.execute( "CREATE INDEX IF NOT EXISTS %s_point_id_idx ON %s.%s ( point_id );", ( AsIs( table ), AsIs( plist[ 'out_schema' ] ), AsIs( table ) ) )
+        conn.commit()
+
     # handle exception
     except psycopg2.Error as e:
         print ( e.pgerror )    
 
     # close connection
     print ( cur.query )
-    conn.close()
+    pgsql.releaseConnection( conn )
 
     return 
 
@@ -98,6 +104,10 @@ def parseArguments(args=None):
                         help='slope option (flat, steep, none)',
                         default='' )
 
+    parser.add_argument('-r', '--rebuild',  
+                        help='rebuild paired sample table from result tables',
+                        action='store_true' )
+
     return parser.parse_args(args)
 
 
@@ -114,6 +124,7 @@ if len ( args.slope ) > 0:
     plist[ 'in_schema' ] += '_' + args.slope
 
 plist[ 'out_schema' ] = plist[ 'in_schema' ].replace( 'result', 'error' ) + '_' + args.platform.lower()
+plist[ 'sample_schema' ] = plist[ 'in_schema' ].replace( 'result', 'sample' )
 
 # for each landcover class 
 for ctype in args.landcover: 
@@ -122,5 +133,6 @@ for ctype in args.landcover:
 
         # create and populate pgsql table
         plist[ 'landcover' ] = ctype
+        pairs.refreshTable( plist, args.rebuild )
         populateTable( plist )
 
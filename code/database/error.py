@@ -3,6 +3,8 @@
 import os
 import sys
 import math
+import io
+import csv
 import time
 import argparse
 
@@ -12,47 +14,96 @@ import datetime as dt
 
 from psycopg2.extensions import AsIs
 
+# import shared project functions
+sys.path.insert(0, os.path.join( os.path.dirname( os.path.abspath( __file__ ) ), '../common' ) )
+import pgsql
+import pairs
+import stats
+
 # landcover classes
 landcover_types = { 'forest', 'grassland', 'sugarcane', 'evergreen' }
 
-# execute query
-def populateTable( plist ):
+# variables aggregated per point
+names = [ 'gamma_vv', 'gamma_vh', 'snap_vv', 'snap_vh', 'vv_error', 'vh_error' ]
 
-    # get connection
-    conn = psycopg2.connect("dbname='{}' user='sac' host='localhost' password='sac'".format( plist[ 'db' ] ) )
-    cur = conn.cursor()
+# get sql expressions finalising mean and stddev from mergeable count, sum and m2 - stddev undefined for single sample
+def getFinalSql( prefix='' ):
 
-    # switch on optional orbit direction parameter
-    query = ''; param_list = ()
-    if plist[ 'orbit' ] == 'ASCENDING' or plist[ 'orbit' ] == 'DESCENDING':   
+    return ', '.join( [ "{1}{0}_sum / NULLIF( {1}{0}_count, 0 ) {0}_mean, SQRT( {1}{0}_m2 / NULLIF( {1}{0}_count - 1, 0 ) ) {0}_stddev".format( name, prefix ) for name in names ] )
+
+
+# get sql aggregates of count, sum and m2 per variable - population variance scaled by count is sum of squared deviations
+def getAggregateSql():
+
+    return ', '.join( [ "COUNT( {0} ) {0}_count, COALESCE( SUM( {0} ), 0 ) {0}_sum, COALESCE( VAR_POP( {0} ) * COUNT( {0} ), 0 ) {0}_m2".format( name ) for name in names ] )
+
+
+# get sql column list of stored count, sum and m2 per variable
+def getStatisticsSql( prefix='' ):
+
+    return ', '.join( [ '{1}{0}_count, {1}{0}_sum, {1}{0}_m2'.format( name, prefix ) for name in names ] )
+
+
+# get sql assignments folding batch count, sum and m2 into existing rows - chan parallel combination
+def getMergeSql():
+
+    assignments = []
+    for name in names:
+
+        n = "( t.{0}_count + d.{0}_count )".format( name )
+        delta = "COALESCE( POWER( d.{0}_sum / NULLIF( d.{0}_count, 0 ) - t.{0}_sum / NULLIF( t.{0}_count, 0 ), 2 ) * t.{0}_count * d.{0}_count / NULLIF( {1}, 0 ), 0 )".format( name, n )
+
+        assignments += [   "{0}_count = {1}".format( name, n ),
+                            "{0}_sum = t.{0}_sum + d.{0}_sum".format( name ),
+                            "{0}_m2 = t.{0}_m2 + d.{0}_m2 + {1}".format( name, delta ),
+                            "{0}_mean = ( t.{0}_sum + d.{0}_sum ) / NULLIF( {1}, 0 )".format( name, n ),
+                            "{0}_stddev = SQRT( ( t.{0}_m2 + d.{0}_m2 + {1} ) / NULLIF( {2} - 1, 0 ) )".format( name, delta, n ) ]
+
+    return ', '.join( assignments )
+
+
+# compute per point count, sum and m2 of paired samples in batch - sql aggregation or streaming aggregator partitioned on point id
+def getBatchStatistics( plist, args, cur, subfilter, merged, seq ):
+
+    columns = [ name + '_' + stat for name in names for stat in [ 'count', 'sum', 'm2' ] ]
+    cur.execute( "CREATE TEMP TABLE delta ( point_id INTEGER, %s ) ON COMMIT DROP;", [ AsIs( ', '.join( [ column + ' double precision' for column in columns ] ) ) ] )
 
-        # join gamma and snap result tables - compute error statistics - filter on orbit
-        query = "CREATE TABLE IF NOT EXISTS %s.%s_%s_%s AS ( " \
-                    "WITH pts AS ( " \
-                        "SELECT a.fdate, ST_AsText(a.geom) geom, a.vv gamma_vv, a.vh gamma_vh, b.vv snap_vv, b.vh snap_vh, a.vv-b.vv vv_error, a.vh-b.vh vh_error, c.filename, c.orbitdirection, c.relativeorbitnumber FROM %s_gamma.%s_%s a " \
-                            "INNER JOIN %s_snap.%s_%s b ON a.fdate = b.fdate AND ST_Equals( a.geom, b.geom ) " \
-                                "INNER JOIN meta c ON a.fdate = c.fdate ) " \
-                                    "SELECT geom, avg(gamma_vv) gamma_vv_mean, stddev(gamma_vv) gamma_vv_stddev, avg( gamma_vh ) gamma_vh_mean, stddev( gamma_vh) gamma_vh_stddev, avg( snap_vv ) snap_vv_mean, stddev( snap_vv ) snap_vv_stddev, avg( snap_vh ) snap_vh_mean, stddev( snap_vh ) snap_vh_stddev, avg(vv_error) vv_error_mean, stddev( vv_error ) vv_error_stddev, avg( vh_error ) vh_error_mean, stddev( vh_error) vh_error_stddev  " \
-                                        "FROM pts WHERE orbitdirection = '%s' GROUP BY geom );"
+    query = "SELECT point_id, gamma_vv, gamma_vh, snap_vv, snap_vh, gamma_vv-snap_vv vv_error, gamma_vh-snap_vh vh_error FROM {} WHERE {} AND seq > %s AND seq <= %s".format( pairs.getTable( plist ), subfilter )
+    if args.engine == 'python':
 
-        param_list = ( AsIs( plist[ 'out_schema' ] ), AsIs( plist[ 'product' ] ), AsIs( plist[ 'landcover' ] ), AsIs( plist[ 'orbit' ].lower() ),
-                            AsIs( plist[ 'in_schema' ] ), AsIs( plist[ 'product' ] ), AsIs( plist[ 'landcover' ] ), 
-                                AsIs( plist[ 'in_schema' ] ), AsIs( plist[ 'product' ] ), AsIs( plist[ 'landcover' ] ),
-                                    AsIs( plist[ 'orbit' ] ) )
+        # stream partitions concurrently - partial states merged per point
+        state = stats.aggregate( plist[ 'db' ], [ ( query + " AND point_id %% %s = %s", ( merged, seq, args.threads, idx ) ) for idx in range( args.threads ) ], names, workers=args.threads )
+
+        buffer = io.StringIO()
+        writer = csv.writer( buffer )
+        for point_id, record in stats.getResults( state ).items():
+            writer.writerow( [ point_id ] + [ record[ column ] for column in columns ] )
+
+        buffer.seek( 0 )
+        cur.copy_expert( "COPY delta FROM STDIN WITH CSV", buffer )
 
     else:
 
-        # join gamma and snap result tables - compute error statistics
-        query = "CREATE TABLE IF NOT EXISTS %s.%s_%s AS ( " \
-                    "WITH pts AS (  " \
-                        "SELECT a.fdate, ST_AsText(a.geom) geom, a.vv gamma_vv, a.vh gamma_vh, b.vv snap_vv, b.vh snap_vh, a.vv-b.vv vv_error, a.vh-b.vh vh_error FROM %s_gamma.%s_%s a " \
-                            "INNER JOIN %s_snap.%s_%s b ON a.fdate = b.fdate AND ST_Equals( a.geom, b.geom ) ) " \
-                                "SELECT geom, avg(gamma_vv) gamma_vv_mean, stddev(gamma_vv) gamma_vv_stddev, avg( gamma_vh ) gamma_vh_mean, stddev( gamma_vh) gamma_vh_stddev, avg( snap_vv ) snap_vv_mean, stddev( snap_vv ) snap_vv_stddev, avg( snap_vh ) snap_vh_mean, stddev( snap_vh ) snap_vh_stddev, avg(vv_error) vv_error_mean, stddev( vv_error ) vv_error_stddev, avg( vh_error ) vh_error_mean, stddev( vh_error) vh_error_stddev  " \
-                                    "FROM pts GROUP BY geom );"
+        cur.execute( "INSERT INTO delta WITH pts AS ( " + query + " ) SELECT point_id, %s FROM pts GROUP BY point_id;", ( merged, seq, AsIs( getAggregateSql() ) ) )
+
+    return
+
+
+# create or incrementally update error table - per point count, sum and m2 stored so new paired samples merge without rescanning history
+def populateTable( plist, args ):
 
-        param_list = ( AsIs( plist[ 'out_schema' ] ), AsIs( plist[ 'product' ] ), AsIs( plist[ 'landcover' ] ), 
-                            AsIs( plist[ 'in_schema' ] ), AsIs( plist[ 'product' ] ), AsIs( plist[ 'landcover' ] ), 
-                                AsIs( plist[ 'in_schema' ] ), AsIs( plist[ 'product' ] ), AsIs( plist[ 'landcover' ] ) )
+    # get connection
+    conn = pgsql.getConnection( plist[ 'db' ] )
+    cur = conn.cursor()
+
+    # optional orbital direction filter
+    subfilter = 'TRUE'
+    table = plist[ 'product' ] + '_' + plist[ 'landcover' ]
+
+    if plist[ 'orbit' ] == 'ASCENDING' or plist[ 'orbit' ] == 'DESCENDING':   
+
+        subfilter = "orbitdirection = '{}'".format( plist[ 'orbit' ] )
+        table += '_' + plist[ 'orbit' ].lower()
 
     try:
 
@@ -60,8 +111,114 @@ def populateTable( plist ):
         cur.execute( "CREATE SCHEMA IF NOT EXISTS %s;", ( [ AsIs( plist[ 'out_schema' ] ) ] )  )
         conn.commit()
 
-        # execute query and commit
-        cur.execute( query, param_list )        
+        cur.execute( "SELECT to_regclass( %s );", [ plist[ 'out_schema' ] + '.' + table ] )
+        exists = cur.fetchone()[ 0 ] is not None
+
+        # existing tables retained unless merging new paired samples
+        if not exists or args.incremental:
+
+            # paired samples already folded into error table
+            merged = pairs.getMerged( cur, plist, plist[ 'out_schema' ] + '.' + table ) if exists else 0
+            if merged is None:
+
+                # tables without mergeable statistics or paired samples recreated since - rebuilt from scratch
+                print ( '... {}.{} not mergeable with paired samples - rebuilding'.format( plist[ 'out_schema' ], table ) )
+                cur.execute( "DROP TABLE %s.%s;", ( AsIs( plist[ 'out_schema' ] ), AsIs( table ) ) )
+                exists, merged = False, 0
+
+            seq = pairs.getSequence( cur, plist, merged )
+            getBatchStatistics( plist, args, cur, subfilter, merged, seq )
+            if not exists:
+
+                # join geometry from sample table
+                cur.execute( "CREATE TABLE %s.%s AS ( SELECT ST_AsText( p.geom ) geom, d.point_id, %s, %s FROM delta d INNER JOIN %s.%s p ON p.point_id = d.point_id );",
+                                ( AsIs( plist[ 'out_schema' ] ), AsIs( table ), AsIs( getFinalSql( 'd.' ) ), AsIs( getStatisticsSql( 'd.' ) ),
+                                    AsIs( plist[ 'sample_schema' ] ), AsIs( plist[ 'landcover' ] ) ) )
+
+                # point id index supports joins between error tables
+                cur.execute( "CREATE INDEX IF NOT EXISTS %s_point_id_idx ON %s.%s ( point_id );", ( AsIs( table ), AsIs( plist[ 'out_schema' ] ), AsIs( table ) ) )
+
+            else:
+
+                # fold batch into existing points - points sampled for first time appended
+                cur.execute( "UPDATE %s.%s t SET %s FROM delta d WHERE t.point_id = d.point_id;", ( AsIs( plist[ 'out_schema' ] ), AsIs( table ), AsIs( getMergeSql() ) ) )
+                cur.execute( "INSERT INTO %s.%s SELECT ST_AsText( p.geom ) geom, d.point_id, %s, %s FROM delta d INNER JOIN %s.%s p ON p.point_id = d.point_id " \
+                                "WHERE NOT EXISTS ( SELECT 1 FROM %s.%s t WHERE t.point_id = d.point_id );",
+                                    ( AsIs( plist[ 'out_schema' ] ), AsIs( table ), AsIs( getFinalSql( 'd.' ) ), AsIs( getStatisticsSql( 'd.' ) ),
+                                        AsIs( plist[ 'sample_schema' ] ), AsIs( plist[ 'landcover' ] ),
+                                            AsIs( plist[ 'out_schema' ] ), AsIs( table ) ) )
+
+            # record merged paired samples in same transaction
+            pairs.setMerged( cur, plist, plist[ 'out_schema' ] + '.' + table, seq )
+            print ( '... paired samples {} - {} merged into {}.{}'.format( merged + 1, seq, plist[ 'out_schema' ], table ) )
+
+            conn.commit()
+
+    # handle exception
+    except psycopg2.Error as e:
+        print ( e.pgerror )    
+
+    # close connection
+    print ( cur.query )
+    pgsql.releaseConnection( conn )
+
+    return 
+
+
+# compute error statistics for all orbit direction and platform combinations in single pass - split into existing error table names with mergeable statistics
+def populateGroupedTables( plist ):
+
+    # get connection
+    conn = pgsql.getConnection( plist[ 'db' ] )
+    cur = conn.cursor()
+
+    # grouping flags distinguish aggregated rows from missing metadata
+    query = "CREATE TEMP TABLE grouped ON COMMIT DROP AS " \
+                "WITH pts AS ( " \
+                    "SELECT point_id, orbitdirection, LOWER( LEFT( filename, 3 ) ) platform, gamma_vv, gamma_vh, snap_vv, snap_vh, gamma_vv-snap_vv vv_error, gamma_vh-snap_vh vh_error FROM %s WHERE seq <= %s ) " \
+                        "SELECT point_id, orbitdirection, platform, GROUPING( orbitdirection ) all_orbits, GROUPING( platform ) all_platforms, %s " \
+                            "FROM pts GROUP BY GROUPING SETS ( ( point_id ), ( point_id, orbitdirection ), ( point_id, platform ), ( point_id, platform, orbitdirection ) );"
+
+    try:
+
+        # execute query - paired samples aggregated bounded by sequence number recorded for each grouping
+        seq = pairs.getSequence( cur, plist, 0 )
+        cur.execute( query, [ AsIs( pairs.getTable( plist ) ), seq, AsIs( getAggregateSql() ) ] )
+
+        # platforms present in paired samples
+        cur.execute( "SELECT DISTINCT platform FROM grouped WHERE all_platforms = 0 AND platform IS NOT NULL ORDER BY platform;" )
+        platforms = [ row[ 0 ] for row in cur.fetchall() ]
+
+        # error schema / table per grouping - error.py and error-platform.py naming
+        for platform in [ None ] + platforms:
+            for orbit in [ None, 'ASCENDING', 'DESCENDING' ]:
+
+                schema = plist[ 'out_schema' ] if platform is None else plist[ 'out_schema' ] + '_' + platform
+                table = plist[ 'product' ] + '_' + plist[ 'landcover' ] if orbit is None else plist[ 'product' ] + '_' + plist[ 'landcover' ] + '_' + orbit.lower()
+
+                subfilter = "all_platforms = 1" if platform is None else "all_platforms = 0 AND platform = '{}'".format( platform )
+                subfilter += " AND all_orbits = 1" if orbit is None else " AND all_orbits = 0 AND orbitdirection = '{}'".format( orbit )
+
+                # existing tables retained
+                cur.execute( "CREATE SCHEMA IF NOT EXISTS %s;", ( [ AsIs( schema ) ] )  )
+                cur.execute( "SELECT to_regclass( %s );", [ schema + '.' + table ] )
+                if cur.fetchone()[ 0 ] is not None:
+                    continue
+
+                # column layout shared with incremental error tables
+                cur.execute( "CREATE TABLE %s.%s AS ( SELECT ST_AsText( p.geom ) geom, s.point_id, %s, %s FROM ( SELECT * FROM grouped WHERE %s ) s " \
+                                "INNER JOIN %s.%s p ON p.point_id = s.point_id );",
+                                    ( AsIs( schema ), AsIs( table ), AsIs( getFinalSql( 's.' ) ), AsIs( getStatisticsSql( 's.' ) ), AsIs( subfilter ), 
+                                        AsIs( plist[ 'sample_schema' ] ), AsIs( plist[ 'landcover' ] ) ) )
+
+                # point id index supports joins between error tables
+                cur.execute( "CREATE INDEX IF NOT EXISTS %s_point_id_idx ON %s.%s ( point_id );", ( AsIs( table ), AsIs( schema ), AsIs( table ) ) )
+
+                # paired samples folded into error table - later runs merge remainder with --incremental
+                pairs.setMerged( cur, plist, schema + '.' + table, seq )
+
+                print ( '... {}.{}'.format( schema, table ) )
+
         conn.commit()
 
     # handle exception
@@ -70,7 +227,7 @@ def populateTable( plist ):
 
     # close connection
     print ( cur.query )
-    conn.close()
+    pgsql.releaseConnection( conn )
 
     return 
 
@@ -102,11 +259,36 @@ def parseArguments(args=None):
                         help='slope option (flat, steep, none)',
                         default='' )
 
+    parser.add_argument('-r', '--rebuild',  
+                        help='rebuild paired sample table from result tables',
+                        action='store_true' )
+
+    parser.add_argument('-e', '--engine',  
+                        help='aggregation engine (sql, python)',
+                        choices=[ 'sql', 'python' ],
+                        default='sql' )
+
+    parser.add_argument('-n', '--threads',  
+                        type=int,
+                        help='number of concurrent partitions (python engine)',
+                        default=1 )
+
+    parser.add_argument('-i', '--incremental',  
+                        help='merge paired samples absent from existing error tables',
+                        action='store_true' )
+
+    parser.add_argument('-g', '--grouping',  
+                        help='compute all orbit direction and platform tables in single pass',
+                        action='store_true' )
+
     return parser.parse_args(args)
 
 
 # parse arguments
 args = parseArguments( sys.argv[1:] )
+
+# pooled connection per concurrent partition plus main thread
+pgsql.max_connections = max( pgsql.max_connections, args.threads + 1 )
 plist = {   'orbit' : args.orbit.upper(), 
             'product' : args.product, 
             'db' : args.database, 
@@ -117,6 +299,7 @@ if len ( args.slope ) > 0:
     plist[ 'in_schema' ] += '_' + args.slope
 
 plist[ 'out_schema' ] = plist[ 'in_schema' ].replace( 'result', 'error' )
+plist[ 'sample_schema' ] = plist[ 'in_schema' ].replace( 'result', 'sample' )
 
 # for each landcover class 
 for ctype in args.landcover: 
@@ -125,5 +308,10 @@ for ctype in args.landcover:
 
         # create and populate pgsql table
         plist[ 'landcover' ] = ctype
-        populateTable( plist )
+        pairs.refreshTable( plist, args.rebuild )
+
+        if args.grouping:
+            populateGroupedTables( plist )
+        else:
+            populateTable( plist, args )
 
@@ -4,11 +4,19 @@ import os
 import sys
 import math
 import time
+import argparse
 
 import psycopg2
 from psycopg2.extensions import AsIs
 
 import numpy as np
+from functools import partial
+
+# import shared project functions
+sys.path.insert(0, os.path.join( os.path.dirname( os.path.abspath( __file__ ) ), '../common' ) )
+import pgsql
+import raster
+import scheduler
 
 # globals
 landcover_types = { 'forest' : [ 1, 15 ], 'grassland' : [ 2 ], 'cultivated' : [ 3, 16, 23, 25, 27 ], 'sugarcane' : [ 6 ], 'coconut' : [ 7, 12 ] }
@@ -40,14 +48,13 @@ def getTypeFilter( ctype ):
 def getEvergreenPoi():
 
     # get connection
-    conn = psycopg2.connect("dbname='fiji' user='sac' host='localhost' password='sac'")
+    conn = pgsql.getConnection( 'fiji' )
     cur = conn.cursor()
 
-    # dump forest points coincident with moist rainfall zone (probably evergreen forest)
+    # dump forest points coincident with moist rainfall zone (probably evergreen forest) - forest point ids and slope retained
     query = "CREATE TABLE IF NOT EXISTS %s.evergreen AS " \
-                "WITH moist_zone AS ( SELECT geom FROM ancillary.rainfall_zone WHERE DN = 3 ), " \
-                    "pts AS ( SELECT a.area, a.geom FROM landcover_poi.forest a, moist_zone b WHERE ST_Intersects ( a.geom, b.geom ) ) " \
-                        "SELECT geom, ST_NearestValue( rast, 1, geom ) slope FROM ancillary.dem_slope, pts WHERE ST_Intersects( rast, geom ); "
+                "WITH moist_zone AS ( SELECT geom FROM ancillary.rainfall_zone WHERE DN = 3 ) " \
+                    "SELECT a.point_id, a.geom, a.slope FROM landcover_poi.forest a, moist_zone b WHERE ST_Intersects ( a.geom, b.geom ); "
 
     try:
 
@@ -57,7 +64,8 @@ def getEvergreenPoi():
         print ( cur.query )
 
         # execute query        
-        cur.execute( "CREATE INDEX ON %s.evergreen USING GIST (geom);", [ AsIs( schema ) ] )
+        cur.execute( "CREATE INDEX IF NOT EXISTS evergreen_geom_idx ON %s.evergreen USING GIST (geom);", [ AsIs( schema ) ] )
+        cur.execute( "CREATE INDEX IF NOT EXISTS evergreen_point_id_idx ON %s.evergreen ( point_id );", [ AsIs( schema ) ] )
         conn.commit()
 
     # handle exception
@@ -67,32 +75,29 @@ def getEvergreenPoi():
     # close connection
     conn.commit()
 
-    conn.close()
     cur.close()
+    pgsql.releaseConnection( conn )
 
     return
 
 
-# construct poi tables
-def getLandcoverPoi( ctype ):
+# get polygon sampling rate and minimum area - oversample smaller areas
+def getSampleRate( ctype ):
 
-    # get connection
-    conn = psycopg2.connect("dbname='fiji' user='sac' host='localhost' password='sac'")
-    cur = conn.cursor()
+    if ctype == 'sugarcane' or ctype == 'coconut':
+        return 1000, 1000
 
-    sample_rate = default_sample_rate
-    min_area = default_min_area
+    return default_sample_rate, default_min_area
 
-    # oversample smaller areas
-    if ctype == 'sugarcane' or ctype == 'coconut':
-        sample_rate = 1000
-        min_area = 1000
 
-    # generate random points inside landcover polygons 
-    query = "CREATE TABLE IF NOT EXISTS %s.%s AS " \
-                "WITH polys AS ( SELECT gid, ST_Area(geom) area, CAST( (ST_Area(geom) / %s ) AS INTEGER ) samples, geom FROM ancillary.fiji_32760 WHERE %s ), " \
-                    "pts AS ( SELECT area, (ST_Dump( ST_GeneratePoints( geom, LEAST( samples, %s ) ) ) ).geom geom FROM polys WHERE area > %s ) " \
-                        "SELECT area, geom, ST_NearestValue( rast, 1, geom ) slope FROM ancillary.dem_slope, pts WHERE ST_Intersects( rast, geom ); "
+# create empty poi table with polygon completion table - existing tables without completion table treated as complete
+def createTable( ctype ):
+
+    pending = False
+
+    # get connection
+    conn = pgsql.getConnection( 'fiji' )
+    cur = conn.cursor()
 
     try:
 
@@ -100,12 +105,117 @@ def getLandcoverPoi( ctype ):
         cur.execute( "CREATE SCHEMA IF NOT EXISTS %s;", [ AsIs( schema ) ] ) 
         conn.commit()
 
-        cur.execute( query, ( AsIs( schema ), AsIs( ctype ), sample_rate, AsIs( getTypeFilter( ctype ) ), max_samples, min_area ) ) 
+        cur.execute( "SELECT to_regclass( %s ), to_regclass( %s );", [ schema + '.' + ctype, schema + '.' + ctype + '_done' ] )
+        exists, tracked = [ obj is not None for obj in cur.fetchone() ]
+
+        if not exists:
+
+            # serial point id unique across concurrently populated chunks - polygons recorded as their points are committed
+            cur.execute( "CREATE TABLE %s.%s ( point_id SERIAL, area double precision, geom GEOMETRY, slope double precision );", ( AsIs( schema ), AsIs( ctype ) ) )
+            cur.execute( "CREATE TABLE %s.%s_done ( gid INTEGER PRIMARY KEY );", ( AsIs( schema ), AsIs( ctype ) ) )
+            conn.commit()
+
+        pending = not exists or tracked
+
+    # handle exception
+    except psycopg2.Error as e:
+        print ( e.pgerror )    
+
+    # close connection
+    print ( cur.query )
+    pgsql.releaseConnection( conn )
+
+    return pending
+
+
+# partition landcover polygons without committed points into chunks of similar polygon count
+def getPolygonChunks( ctype, size ):
+
+    chunks = []
+    sample_rate, min_area = getSampleRate( ctype )
+
+    # get connection
+    conn = pgsql.getConnection( 'fiji' )
+    cur = conn.cursor()
+
+    try:
+
+        # execute query
+        cur.execute( "SELECT gid FROM ancillary.fiji_32760 p WHERE ( %s ) AND ST_Area( geom ) > %s AND NOT EXISTS ( SELECT 1 FROM %s.%s_done d WHERE d.gid = p.gid ) ORDER BY gid;", 
+                        ( AsIs( getTypeFilter( ctype ) ), min_area, AsIs( schema ), AsIs( ctype ) ) )
+        gids = [ row[ 0 ] for row in cur.fetchall() ]
+
+        chunks = [ gids[ idx : idx + size ] for idx in range( 0, len( gids ), size ) ]
+
+    # handle exception
+    except psycopg2.Error as e:
+        print ( e.pgerror )    
+
+    # close connection
+    pgsql.releaseConnection( conn )
+
+    return chunks
+
+
+# generate random points inside chunk of landcover polygons - stable integer id carried through sample, result and error tables
+def populateChunk( args, task ):
+
+    # get connection
+    conn = pgsql.getConnection( 'fiji' )
+    cur = conn.cursor()
+
+    sample_rate, min_area = getSampleRate( task[ 'ctype' ] )
+
+    query = "WITH polys AS ( SELECT gid, ST_Area(geom) area, CAST( (ST_Area(geom) / %s ) AS INTEGER ) samples, geom FROM ancillary.fiji_32760 WHERE gid = ANY( %s ) ), " \
+                "pts AS ( SELECT area, (ST_Dump( ST_GeneratePoints( geom, LEAST( samples, %s ) ) ) ).geom geom FROM polys ) "
+
+    try:
+
+        if args.geotiff is None:
+
+            # slope nearest to point attached from raster table - pixel containing point with points on nodata dropped if requested
+            slope = "ST_Value( rast, 1, geom )" if args.drop_nodata else "ST_NearestValue( rast, 1, geom )"
+            cur.execute( "INSERT INTO %s.%s ( area, geom, slope ) " + query + \
+                            "SELECT area, geom, slope FROM ( SELECT area, geom, %s slope FROM ancillary.dem_slope, pts WHERE ST_Intersects( rast, geom ) ) t WHERE %s;",
+                                ( AsIs( schema ), AsIs( task[ 'ctype' ] ), sample_rate, task[ 'gids' ], max_samples, 
+                                    AsIs( slope ), AsIs( 'slope IS NOT NULL' if args.drop_nodata else 'TRUE' ) ) ) 
+
+        else:
+
+            # generated points with coordinates in slope image reference system - pixel containing point sampled in memory
+            raster.copyPointValues( cur, args.geotiff, query + "SELECT area, geom, ST_X( ST_Transform( geom, %s ) ), ST_Y( ST_Transform( geom, %s ) ) FROM pts;", 
+                                        ( sample_rate, task[ 'gids' ], max_samples, args.epsg, args.epsg ), 
+                                            '{}.{}'.format( schema, task[ 'ctype' ] ), [ 'area', 'geom', 'slope' ], drop_nodata=args.drop_nodata )
+
+        # record polygons of chunk in same transaction - interrupted runs resume with remaining polygons
+        cur.execute( "INSERT INTO %s.%s_done SELECT unnest( %s::integer[] );", ( AsIs( schema ), AsIs( task[ 'ctype' ] ), task[ 'gids' ] ) )
         conn.commit()
-        print ( cur.query )
+
+    # handle exception - transaction rolled back, raised for retry by scheduler
+    except psycopg2.Error as e:
+        print ( e.pgerror )    
+        raise
+
+    # close connection
+    finally:
+        pgsql.releaseConnection( conn )
+
+    return
+
+
+# create indexes on populated poi table
+def createIndexes( ctype ):
+
+    # get connection
+    conn = pgsql.getConnection( 'fiji' )
+    cur = conn.cursor()
+
+    try:
 
         # execute query        
-        cur.execute( "CREATE INDEX ON %s.%s USING GIST (geom);", ( AsIs( schema ), AsIs( ctype ) ) )
+        cur.execute( "CREATE INDEX IF NOT EXISTS %s_geom_idx ON %s.%s USING GIST (geom);", ( AsIs( ctype ), AsIs( schema ), AsIs( ctype ) ) )
+        cur.execute( "CREATE INDEX IF NOT EXISTS %s_point_id_idx ON %s.%s ( point_id );", ( AsIs( ctype ), AsIs( schema ), AsIs( ctype ) ) )
+        cur.execute( "ANALYZE %s.%s;", ( AsIs( schema ), AsIs( ctype ) ) )
         conn.commit()
 
     # handle exception
@@ -113,18 +223,81 @@ def getLandcoverPoi( ctype ):
         print ( e.pgerror )    
 
     # close connection
-    conn.commit()
-
-    conn.close()
-    cur.close()
+    print ( cur.query )
+    pgsql.releaseConnection( conn )
 
     return
 
 
-# for each landcover class
+# parse command line arguments
+def parseArguments(args=None):
+
+    parser = argparse.ArgumentParser(description='fiji-poi')
+
+    # optional arguments
+    parser.add_argument('-n', '--threads',  
+                        type=int,
+                        help='maximum number of concurrent database sessions',
+                        default=1 )
+
+    parser.add_argument('-k', '--chunk',  
+                        type=int,
+                        help='number of landcover polygons per task',
+                        default=500 )
+
+    parser.add_argument('-r', '--retries',  
+                        type=int,
+                        help='number of retries per task on transient database errors',
+                        default=3 )
+
+    parser.add_argument('-g', '--geotiff',  
+                        help='slope geotiff sampled in memory instead of ancillary.dem_slope raster table' )
+
+    parser.add_argument('-x', '--drop-nodata',  
+                        help='drop points on slope nodata pixels - by default raster table path takes nearest valid pixel, geotiff path loads null slope',
+                        action='store_true' )
+
+    return parser.parse_args(args)
+
+
+# parse arguments
+args = parseArguments( sys.argv[1:] )
+
+# pooled connection per concurrent thread plus main thread
+pgsql.max_connections = max( pgsql.max_connections, args.threads + 1 )
+
+# points transformed into slope image reference system
+if args.geotiff is not None:
+
+    args.epsg = raster.getEpsg( args.geotiff )
+    if args.epsg is None:
+        sys.exit( 'unable to identify epsg of slope geotiff: ' + args.geotiff )
+
+# polygon chunks of new or incomplete landcover classes - completed poi tables retained
+tasklist = []
 for ctype in landcover_types:
-    getLandcoverPoi( ctype )
+
+    if createTable( ctype ):
+        tasklist += [ { 'ctype' : ctype, 'gids' : gids } for gids in getPolygonChunks( ctype, args.chunk ) ]
+
+for index, task in enumerate( tasklist ):
+    task[ 'index' ] = index
+
+# classes and polygon chunks generated concurrently
+results = scheduler.runThreads( partial( populateChunk, args ), tasklist, 
+                                    threads=args.threads, retries=args.retries, transient=psycopg2.OperationalError, 
+                                    weight=lambda task: len( task[ 'gids' ] ) )
+
+scheduler.printSummary( results, label=lambda task: 'task {:>4} - {} - {} polygons'.format( task[ 'index' ], task[ 'ctype' ], len( task[ 'gids' ] ) ) )
+
+for ctype in set( [ task[ 'ctype' ] for task in tasklist ] ):
+    createIndexes( ctype )
+
+# failed chunks leave poi tables incomplete - evergreen derived from complete forest table only
+failures = len( [ result for result in results if result[ 'status' ] != 'ok' ] )
+if failures > 0:
+    print ( '... {} tasks failed - poi tables incomplete, rerun to generate remaining polygons'.format( failures ) )
+    sys.exit( 1 )
 
 # classify point samples into evergreen / dry tropical
 getEvergreenPoi()
-
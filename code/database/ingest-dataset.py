@@ -6,6 +6,8 @@ import fnmatch
 import argparse
 import shutil
 
+from concurrent.futures import ThreadPoolExecutor
+
 from osgeo import gdal
 from xml.dom import minidom
 from datetime import datetime
@@ -16,41 +18,37 @@ import ps
 import fio
 import parser
 
-# get configuration
-def updateImages( path_list ):
+# import shared project functions
+sys.path.insert(0, os.path.join( os.path.dirname( os.path.abspath( __file__ ) ), '../common' ) )
+import manifest
+import raster
 
-    # initialise driver and options
-    options = [ 'TILED=YES', 'BLOCKXSIZE=256', 'BLOCKYSIZE=256', 'INTERLEAVE=PIXEL' ]
-    driver = gdal.GetDriverByName( "GTiff" )
+# rewrite images not already stored with tiled layout
+def updateImages( path_list, threads=1 ):
 
-    # open each image
-    for obj in path_list:
+    # shared tiled layout - pixel interleave for multiband images
+    options = raster.tile_options + [ 'INTERLEAVE=PIXEL' ]
 
-        # create copy with tiled options
-        src_ds = gdal.Open( obj )
-        new_ds = driver.CreateCopy( obj + '.tmp', src_ds, options = options )
-        
-        new_ds.FlushCache()
-        new_ds = None
+    # skip images already written with matching block structure and compression
+    update_list = [ obj for obj in path_list if not raster.isConformant( obj, options ) ]
+    print ( '... rewriting {} of {} images'.format( len( update_list ), len( path_list ) ) )
 
-        # overwrite existing file
-        shutil.move( obj + '.tmp', obj )
+    # gdal releases gil during copy - rewrite concurrently across thread pool
+    with ThreadPoolExecutor( max_workers=threads ) as executor:
+        list( executor.map( lambda obj: raster.rewriteTiles( obj, options ), update_list ) )
 
     return
 
-# compile cross-referenced imagery into multiband vrt file 
-def compileVrt( scene, product ):
+# get images matching product band configuration - none unless every band is matched
+def getBandFiles( scene, product ):
 
-    out_pathname = None
+    sorted_list = []
 
     # generate file list
     filelist = fio.getFileList( '*', scene )
     if len( filelist ) > 0:
 
         # need to guarantee consistent band ordering 
-        sorted_list = []
-
-        # for each band
         bands = product.getElementsByTagName('band')
         for band in bands:
 
@@ -64,14 +62,21 @@ def compileVrt( scene, product ):
                         sorted_list.append( obj )
                         break;
 
-    # build vrt on validation of successful sort
-    if len ( sorted_list ) == len ( bands ):
+        # validate successful sort
+        if len ( sorted_list ) == len ( bands ):
+            return sorted_list
+
+    return None
+
+
+# compile cross-referenced imagery into multiband vrt file 
+def compileVrt( scene, product, sorted_list, threads=1 ):
 
-        out_pathname = scene + '/' + product.attributes[ "name" ].value + '.vrt'
-        updateImages( sorted_list )
+    out_pathname = scene + '/' + product.attributes[ "name" ].value + '.vrt'
+    updateImages( sorted_list, threads )
 
-        vrt = gdal.BuildVRT( out_pathname, sorted_list, options=gdal.BuildVRTOptions(separate=True) )
-        vrt = None 
+    vrt = gdal.BuildVRT( out_pathname, sorted_list, options=gdal.BuildVRTOptions(separate=True) )
+    vrt = None 
 
     return out_pathname
 
@@ -144,11 +149,27 @@ def parseArguments(args=None):
                         default=None,
                         type=valid_date )
 
+    parser.add_argument('-n', '--threads',
+                        type=int,
+                        help='number of threads rewriting images',
+                        default=1 )
+
+    parser.add_argument('--manifest',
+                        help='manifest recording ingested scenes (default: <path>/manifest.db)',
+                        default=None )
+
+    parser.add_argument('--force',
+                        help='ingest scenes recorded as complete in manifest',
+                        action='store_true' )
+
     return parser.parse_args(args)
 
 
 # parse arguments and check existence of dem file
 args = parseArguments( sys.argv[1:] )
+if args.manifest is None:
+    args.manifest = os.path.join( args.path, 'manifest.db' )
+
 if os.path.exists( args.cfg ):
 
     # retrieve product configuration 
@@ -160,19 +181,29 @@ if os.path.exists( args.cfg ):
         if len ( scene_list ) > 0:
 
             # for each scene
+            params = { 'product' : product.attributes[ "name" ].value, 'cfg' : os.path.abspath( args.cfg ) }
             for scene in scene_list:
                 print ( 'processing scene: ' + scene )
 
-                # generate multi-band vrt 
-                out_pathname = compileVrt( scene, product )
-                if out_pathname is not None:
+                # get band images
+                sorted_list = getBandFiles( scene, product )
+                if sorted_list is not None:
+
+                    # skip scenes ingested in previous runs with unchanged band images and parameters
+                    if not args.force and manifest.isComplete( args.manifest, scene, 'ingest', dict( params, files=manifest.getFileState( sorted_list ) ) ):
+                        print( '... already ingested - skipping' )
+                        continue
+
+                    # generate multi-band vrt 
+                    out_pathname = compileVrt( scene, product, sorted_list, args.threads )
 
                     # execute ingestion
                     out, err, code = ps.execute( '/sac/bin/DBIngest-Raster.py', [ out_pathname, args.cfg, product.attributes[ "name" ].value ] )
-                    code = 0
                     if code != 0:
                         print( str( err ) )
                     else:
+                        # state recorded after rewrite to tiled layout
+                        manifest.setComplete( args.manifest, scene, 'ingest', dict( params, files=manifest.getFileState( sorted_list ) ) )
                         print( '... ok!' )
             
                 else:
@@ -13,23 +13,89 @@ import datetime as dt
 from threading import Thread
 from psycopg2.extensions import AsIs
 
+# import shared project functions
+sys.path.insert(0, os.path.join( os.path.dirname( os.path.abspath( __file__ ) ), '../common' ) )
+import pgsql
+
 # landcover types
 landcover_types = { 'forest', 'grassland', 'sugarcane', 'evergreen' }
 
 # slope thresholds
 slope= { 'flat' : { 'min' : 0.0, 'max' : 15.0 }, 'steep' : { 'min' : 20.0, 'max' : 1000.0 } }
 
+# get bbox filter if aoi defined - resolved through gist index
+def getAoiFilter( args ):
+
+    sub_filter = ''
+    if args.aoi is not None:
+        sub_filter = "ST_Intersects ( geom, ST_Transform( ST_MakeEnvelope( {}, {}, {}, {}, 4326 ), {} ) )".format( args.aoi[ 0 ], args.aoi[ 1 ], args.aoi[ 2 ], args.aoi[ 3 ], args.aoi[ 4 ] )
+
+    return sub_filter
+
+
+# oversampling factor applied to page sample fraction - compensates for estimate error
+oversample = 2.0
+
+# get sample fraction (percent) of poi table pages expected to yield requested number of filtered points
+def getSamplePercent( cur, args, ctype, sub_filter ):
+
+    # planner estimate of points passing filters - avoids counting candidates
+    cur.execute( "EXPLAIN ( FORMAT JSON ) SELECT point_id FROM landcover_poi.%s WHERE " + sub_filter + ";", ( AsIs( ctype ), ) )
+    rows = cur.fetchone()[ 0 ][ 0 ][ 'Plan' ][ 'Plan Rows' ]
+
+    return min( 100.0, 100.0 * oversample * args.samples / max( rows, 1 ) )
+
+
+# get query generating selection of points - bottom-k of seeded hash of point id is uniform sample without replacement
+def getSampleQuery( args, sub_filter, method, percent=100.0 ):
+
+    # legacy ordering of complete candidate set - not reproducible
+    if method == 'random':
+        return "CREATE TABLE %s.%s AS SELECT point_id, geom, slope FROM landcover_poi.%s WHERE " + sub_filter + " ORDER BY RANDOM() LIMIT %s;"
+
+    # opt-in page level sample read before filters - cost proportional to sampled pages but whole pages selected, points clustered spatially as poi rows are loaded by polygon chunk
+    tablesample = ''
+    if method == 'system':
+        tablesample = 'TABLESAMPLE SYSTEM ( {} ) REPEATABLE ( {} )'.format( percent, args.seed )
+
+    # hash method reads and hashes every candidate passing filters - bounded top-k heap avoids full sort but cost remains proportional to candidates
+    return "CREATE TABLE %s.%s AS SELECT point_id, geom, slope FROM landcover_poi.%s " + tablesample + " WHERE " + sub_filter + \
+                " ORDER BY hashint4extended( point_id, {} ), point_id LIMIT %s;".format( args.seed )
+
+
+# one-off migration of poi tables generated before point ids were recorded - serial ids follow physical row order
+def assignPointIds( args, ctype ):
+
+    # get connection
+    conn = pgsql.getConnection( args.database )
+    cur = conn.cursor()
+
+    try:
+
+        # execute query
+        cur.execute( "ALTER TABLE landcover_poi.%s ADD COLUMN IF NOT EXISTS point_id SERIAL;" , ( AsIs( ctype ), ) )
+        conn.commit()
+
+    # handle exception
+    except psycopg2.Error as e:
+        print ( e.pgerror )    
+
+    # close connection
+    print ( cur.query )
+    pgsql.releaseConnection( conn )
+
+    return
+
+
 # generate random selection of points coincident with landcover class and aoi
 def populateTable( args, ctype ):
 
     # get connection
-    conn = psycopg2.connect("dbname='{}' user='sac' host='localhost' password='sac'".format( args.database ) )
+    conn = pgsql.getConnection( args.database )
     cur = conn.cursor()
 
     # construct bbox filter if aoi defined
-    sub_filter = ''
-    if args.aoi is not None:
-        sub_filter = "ST_Intersects ( geom, ST_Transform( ST_MakeEnvelope( {}, {}, {}, {}, 4326 ), {} ) )".format( args.aoi[ 0 ], args.aoi[ 1 ], args.aoi[ 2 ], args.aoi[ 3 ], args.aoi[ 4 ] )
+    sub_filter = getAoiFilter( args )
 
     # add slope thresholds if configured
     if len( args.slope ) > 0:
@@ -39,16 +105,14 @@ def populateTable( args, ctype ):
 
         sub_filter += "slope >= {} AND slope <= {}".format( slope[ args.slope ][ 'min' ], slope[ args.slope ][ 'max' ] )
 
+    if len( sub_filter ) == 0:
+        sub_filter = 'TRUE'
+
     # get schema name   
     schema = 'sample'
     if len ( args.slope ) > 0:
         schema += '_' + args.slope
 
-    # construct query
-    query = "CREATE TABLE %s.%s AS WITH pts AS ( SELECT geom, slope FROM landcover_poi.%s ORDER BY RANDOM() ) " \
-                " SELECT geom, slope FROM pts WHERE " \
-                    + sub_filter + " ORDER BY RANDOM() LIMIT %s;"
-
     try:
 
         # create sample schema if not exists
@@ -60,7 +124,93 @@ def populateTable( args, ctype ):
         conn.commit()
 
         # execute query
-        cur.execute( query, ( AsIs( schema ), AsIs( ctype ), AsIs( ctype ), AsIs( args.samples ) ) )
+        percent = getSamplePercent( cur, args, ctype, sub_filter ) if args.method == 'system' else 100.0
+        cur.execute( getSampleQuery( args, sub_filter, args.method, percent ), ( AsIs( schema ), AsIs( ctype ), AsIs( ctype ), AsIs( args.samples ) ) )
+
+        # page sample yielded too few points - redraw from complete candidate set
+        if args.method == 'system' and cur.rowcount < args.samples and percent < 100.0:
+
+            print ( '... page sample yielded {} of {} points - redrawing'.format( cur.rowcount, args.samples ) )
+            cur.execute( "DROP TABLE %s.%s;" , ( AsIs( schema ), AsIs( ctype ) ) )
+            cur.execute( getSampleQuery( args, sub_filter, 'hash' ), ( AsIs( schema ), AsIs( ctype ), AsIs( ctype ), AsIs( args.samples ) ) )
+
+        conn.commit()
+
+        # point id index supports joins with result tables
+        cur.execute( "CREATE INDEX ON %s.%s ( point_id );" , ( AsIs( schema ), AsIs( ctype ) ) )
+        conn.commit()
+        
+    # handle exception
+    except psycopg2.Error as e:
+        print ( e.pgerror )    
+
+    # close connection
+    print ( cur.query )
+    pgsql.releaseConnection( conn )
+
+    return
+
+
+# parse strata arguments into slope band and quota - none denotes all slopes
+def getStrata( args ):
+
+    strata = []
+    for arg in args.strata:
+
+        band, _, quota = arg.partition( ':' )
+        if band != 'none' and band not in slope:
+            sys.exit( 'unknown slope band: ' + band )
+
+        strata.append( ( '' if band == 'none' else band, int( quota ) if len( quota ) > 0 else args.samples ) )
+
+    return strata
+
+
+# generate stratified selection of points for all slope bands in single scan of poi table - per band quota
+def populateStrata( args, ctype, strata ):
+
+    # get connection
+    conn = pgsql.getConnection( args.database )
+    cur = conn.cursor()
+
+    # slope band definitions with quota - empty band covers all slopes
+    bands = ', '.join( [ cur.mogrify( "( %s, %s, %s, %s )", ( band, slope[ band ][ 'min' ] if band else 0.0, slope[ band ][ 'max' ] if band else 0.0, quota ) ).decode()
+                            for band, quota in strata ] )
+
+    sub_filter = getAoiFilter( args )
+    if len( sub_filter ) == 0:
+        sub_filter = 'TRUE'
+
+    # rank candidates within each band on seeded hash - identical selection to single band hash method
+    query = "CREATE TEMP TABLE strata ON COMMIT DROP AS " \
+                "WITH bands ( band, min, max, quota ) AS ( VALUES " + bands + " ), " \
+                    "pts AS ( SELECT point_id, geom, slope FROM landcover_poi.%s WHERE " + sub_filter + " ), " \
+                        "ranked AS ( SELECT b.band, b.quota, p.point_id, p.geom, p.slope, " \
+                            "ROW_NUMBER() OVER ( PARTITION BY b.band ORDER BY hashint4extended( p.point_id, %s ), p.point_id ) rn " \
+                                "FROM pts p INNER JOIN bands b ON b.band = '' OR ( p.slope >= b.min AND p.slope <= b.max ) ) " \
+                                    "SELECT band, point_id, geom, slope FROM ranked WHERE rn <= quota;"
+
+    try:
+
+        # execute query
+        cur.execute( query, ( AsIs( ctype ), args.seed ) )
+
+        # split strata into existing schema / table naming
+        for band, quota in strata:
+
+            schema = 'sample'
+            if len( band ) > 0:
+                schema += '_' + band
+
+            cur.execute( "CREATE SCHEMA IF NOT EXISTS %s;", ( [ AsIs( schema ) ] ) )
+            cur.execute( "DROP TABLE IF EXISTS %s.%s;" , ( AsIs( schema ), AsIs( ctype ) ) )
+
+            cur.execute( "CREATE TABLE %s.%s AS SELECT point_id, geom, slope FROM strata WHERE band = %s;" , ( AsIs( schema ), AsIs( ctype ), band ) )
+            print ( '... {}.{}: {} of {} points'.format( schema, ctype, cur.rowcount, quota ) )
+
+            # point id index supports joins with result tables
+            cur.execute( "CREATE INDEX ON %s.%s ( point_id );" , ( AsIs( schema ), AsIs( ctype ) ) )
+
         conn.commit()
         
     # handle exception
@@ -69,7 +219,7 @@ def populateTable( args, ctype ):
 
     # close connection
     print ( cur.query )
-    conn.close()
+    pgsql.releaseConnection( conn )
 
     return
 
@@ -89,6 +239,17 @@ def parseArguments(args=None):
                         help='number of point samples to compute statistics per scene',
                         default='10000')
 
+    parser.add_argument('-m', '--method',
+                        help='sampling method - hash (default): uniform seeded hash over all filtered candidates, cost proportional to candidates; ' \
+                                'system: opt-in page sample refined by seeded hash, cost proportional to sample, not uniform - points clustered spatially by page; random: legacy unseeded order',
+                        choices=[ 'hash', 'system', 'random' ],
+                        default='hash')
+
+    parser.add_argument('-r', '--seed',
+                        type=int,
+                        help='seed for reproducible point selection',
+                        default=0)
+
     parser.add_argument('-a', '--aoi',  
                         nargs=5,                     
                         help='latitude / longitude bbox to constrain statistical analysis (xmin ymin xmax ymax target-epsg)' )
@@ -102,15 +263,29 @@ def parseArguments(args=None):
                         help='slope option (flat, steep, none)',
                         default='' )
 
+    parser.add_argument('-t', '--strata',  
+                        nargs='+',                     
+                        help='stratified sampling of slope bands in single scan (none, flat, steep) with optional quota (flat:5000)' )
+
+    parser.add_argument('--assign-ids',  
+                        help='assign point ids to legacy poi tables generated without them and exit',
+                        action='store_true' )
+
     return parser.parse_args(args)
 
 
 # parse arguments
 args = parseArguments( sys.argv[1:] )
 
-# generate sample points for landcover classes
+# generate sample points for landcover classes - all slope bands in single scan if strata defined
 for ctype in landcover_types:
     if ctype in args.landcover:
-        populateTable( args, ctype )
+
+        if args.assign_ids:
+            assignPointIds( args, ctype )
+        elif args.strata is not None:
+            populateStrata( args, ctype, getStrata( args ) )
+        else:
+            populateTable( args, ctype )
 
 
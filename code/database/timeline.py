@@ -3,6 +3,8 @@
 import os
 import sys
 import math
+import io
+import csv
 import time
 import argparse
 
@@ -12,57 +14,144 @@ import datetime as dt
 
 from psycopg2.extensions import AsIs
 
+# import shared project functions
+sys.path.insert(0, os.path.join( os.path.dirname( os.path.abspath( __file__ ) ), '../common' ) )
+import pgsql
+import pairs
+import stats
+
 # landcover types
 landcover_types = { 'forest', 'grassland', 'sugarcane', 'evergreen', 'settlement', 'water', 'cultivated', 'coconut' }
 
-# create table utilised for temporal signature plots
-def populateTable( plist ):
+# get timeline table name and paired sample filter - dates of paired samples not yet aggregated located through sequence number watermark
+def getTableFilter( plist, cur, incremental=False ):
 
-    # get connection
-    conn = psycopg2.connect("dbname='{}' user='sac' host='localhost' password='sac'".format( plist[ 'db' ] ) )
-    cur = conn.cursor()
+    # optional orbital direction filter
+    subfilter = 'TRUE'
+    table = plist[ 'product' ] + '_' + plist[ 'landcover' ]
 
-    # compute backscatter statistics mapped to acquisition datetime - filter by orbit direction
-    query = ''; param_list = ()
     if plist[ 'orbit' ] == 'ASCENDING' or plist[ 'orbit' ] == 'DESCENDING':   
 
-        query = "CREATE TABLE IF NOT EXISTS %s.%s_%s_%s AS ( " \
-                    "WITH pts AS ( SELECT DATE(a.fdate) fdate, a.vv gamma_vv, a.vh gamma_vh, b.vv snap_vv, b.vh snap_vh, c.orbitdirection FROM %s_gamma.%s_%s a " \
-                        "INNER JOIN %s_snap.%s_%s b ON a.fdate = b.fdate AND ST_Equals( a.geom, b.geom ) " \
-                            "INNER JOIN meta c ON a.fdate = c.fdate ) " \
-                                "SELECT fdate, AVG(gamma_vv) gamma_vv_mean, STDDEV(gamma_vv) gamma_vv_stddev, AVG(gamma_vh) gamma_vh_mean, STDDEV(gamma_vh) gamma_vh_stddev, " \
-                                    "AVG(snap_vv) snap_vv_mean, STDDEV(snap_vv) snap_vv_stddev, AVG(snap_vh) snap_vh_mean, STDDEV(snap_vh) snap_vh_stddev, " \
-                                        "SQRT( AVG ( POWER ( gamma_vv - snap_vv, 2 ) ) ) vv_rmse, SQRT( AVG ( POWER ( gamma_vh - snap_vh, 2 ) ) ) vh_rmse FROM pts " \
-                                            "WHERE orbitdirection = '%s' GROUP BY fdate ORDER BY fdate );"
-
-        param_list = ( AsIs( plist[ 'out_schema' ] ), AsIs( plist[ 'product' ] ), AsIs( plist[ 'landcover' ] ), AsIs( plist[ 'orbit' ] ),
-                            AsIs( plist[ 'in_schema' ] ), AsIs( plist[ 'product' ] ), AsIs( plist[ 'landcover' ] ), 
-                                AsIs( plist[ 'in_schema' ] ), AsIs( plist[ 'product' ] ), AsIs( plist[ 'landcover' ] ), 
-                                    AsIs( plist[ 'orbit' ] ) )
-
-    else:
-
-        # compute backscatter statistics mapped to acquisition datetime
-        query = "CREATE TABLE IF NOT EXISTS %s.%s_%s AS ( " \
-                    "WITH pts AS ( SELECT DATE(a.fdate) fdate, a.vv gamma_vv, a.vh gamma_vh, b.vv snap_vv, b.vh snap_vh FROM %s_gamma.%s_%s a " \
-                        "INNER JOIN %s_snap.%s_%s b ON a.fdate = b.fdate AND ST_Equals( a.geom, b.geom ) ) " \
-                            "SELECT fdate, AVG(gamma_vv) gamma_vv_mean, STDDEV(gamma_vv) gamma_vv_stddev, AVG(gamma_vh) gamma_vh_mean, STDDEV(gamma_vh) gamma_vh_stddev, " \
-                                "AVG(snap_vv) snap_vv_mean, STDDEV(snap_vv) snap_vv_stddev, AVG(snap_vh) snap_vh_mean, STDDEV(snap_vh) snap_vh_stddev, " \
-                                    "SQRT( AVG ( POWER ( gamma_vv - snap_vv, 2 ) ) ) vv_rmse, SQRT( AVG ( POWER ( gamma_vh - snap_vh, 2 ) ) ) vh_rmse FROM pts " \
-                                        "GROUP BY fdate ORDER BY fdate );"
-                    
-        param_list = ( AsIs( plist[ 'out_schema' ] ), AsIs( plist[ 'product' ] ), AsIs( plist[ 'landcover' ] ), 
-                            AsIs( plist[ 'in_schema' ] ), AsIs( plist[ 'product' ] ), AsIs( plist[ 'landcover' ] ), 
-                                AsIs( plist[ 'in_schema' ] ), AsIs( plist[ 'product' ] ), AsIs( plist[ 'landcover' ] ) )
+        subfilter = "orbitdirection = '{}'".format( plist[ 'orbit' ] )
+        table += '_' + plist[ 'orbit' ]
+
+    # create sample schema if not exists
+    cur.execute( "CREATE SCHEMA IF NOT EXISTS %s;", ( [ AsIs( plist[ 'out_schema' ] ) ] )  )
+
+    cur.execute( "SELECT to_regclass( %s );", [ plist[ 'out_schema' ] + '.' + table ] )
+    exists = cur.fetchone()[ 0 ] is not None
+
+    # existing tables retained unless appending new paired samples
+    seq = None
+    if not exists or incremental:
+
+        # paired samples already aggregated into timeline table - samples beyond bound left to later runs
+        merged = pairs.getMerged( cur, plist, plist[ 'out_schema' ] + '.' + table ) if exists else 0
+        seq = pairs.getSequence( cur, plist, merged or 0 )
+        bound = " AND seq <= {}".format( seq )
+
+        if exists and merged is None:
+
+            # tables created before samples were tracked or paired samples recreated since - every date recomputed
+            cur.execute( "DELETE FROM %s.%s;", ( AsIs( plist[ 'out_schema' ] ), AsIs( table ) ) )
+            print ( '... recomputing all dates in {}.{}'.format( plist[ 'out_schema' ], table ) )
+
+        elif exists:
+
+            # dates of new samples recomputed from every sample on date - points backfilled for aggregated acquisitions included
+            cur.execute( "SELECT DISTINCT DATE( fdate ) FROM %s WHERE %s AND seq > %s%s;", ( AsIs( pairs.getTable( plist ) ), AsIs( subfilter ), merged, AsIs( bound ) ) )
+            dates = sorted( [ row[ 0 ] for row in cur.fetchall() ] )
+            cur.execute( "DELETE FROM %s.%s WHERE fdate = ANY( %s );", ( AsIs( plist[ 'out_schema' ] ), AsIs( table ), dates ) )
+
+            subfilter += cur.mogrify( " AND DATE( fdate ) = ANY( %s::date[] )", [ dates ] ).decode()
+            print ( '... paired samples {} - {} - recomputing {} dates in {}.{}'.format( merged + 1, seq, len( dates ), plist[ 'out_schema' ], table ) )
+
+        subfilter += bound
+
+    return table, subfilter, exists, seq
+
+
+# create table utilised for temporal signature plots - dates of new acquisitions recomputed in incremental mode
+def populateTable( plist, incremental=False ):
+
+    # get connection
+    conn = pgsql.getConnection( plist[ 'db' ] )
+    cur = conn.cursor()
 
     try:
 
-        # create sample schema if not exists
-        cur.execute( "CREATE SCHEMA IF NOT EXISTS %s;", ( [ AsIs( plist[ 'out_schema' ] ) ] )  )
+        table, subfilter, exists, seq = getTableFilter( plist, cur, incremental )
+        if seq is not None:
+
+            # compute backscatter statistics mapped to acquisition datetime from shared paired sample table
+            query = "WITH pts AS ( SELECT DATE(fdate) fdate, gamma_vv, gamma_vh, snap_vv, snap_vh FROM %s WHERE %s ) " \
+                        "SELECT fdate, AVG(gamma_vv) gamma_vv_mean, STDDEV(gamma_vv) gamma_vv_stddev, AVG(gamma_vh) gamma_vh_mean, STDDEV(gamma_vh) gamma_vh_stddev, " \
+                            "AVG(snap_vv) snap_vv_mean, STDDEV(snap_vv) snap_vv_stddev, AVG(snap_vh) snap_vh_mean, STDDEV(snap_vh) snap_vh_stddev, " \
+                                "SQRT( AVG ( POWER ( gamma_vv - snap_vv, 2 ) ) ) vv_rmse, SQRT( AVG ( POWER ( gamma_vh - snap_vh, 2 ) ) ) vh_rmse FROM pts " \
+                                    "GROUP BY fdate ORDER BY fdate"
+
+            if exists:
+                query = "INSERT INTO %s.%s " + query + ";"
+            else:
+                query = "CREATE TABLE %s.%s AS ( " + query + " );"
+
+            param_list = ( AsIs( plist[ 'out_schema' ] ), AsIs( table ), 
+                                AsIs( pairs.getTable( plist ) ), AsIs( subfilter ) )
+
+            # execute query
+            cur.execute( query, param_list )        
+            if exists:
+                print ( '... {} dates written to {}.{}'.format( cur.rowcount, plist[ 'out_schema' ], table ) )
+
+            pairs.setMerged( cur, plist, plist[ 'out_schema' ] + '.' + table, seq )
+
         conn.commit()
 
-        # execute query
-        cur.execute( query, param_list )        
+    # handle exception
+    except psycopg2.Error as e:
+        print ( e.pgerror )    
+
+    # close connection
+    print ( cur.query )
+    pgsql.releaseConnection( conn )
+
+    return 
+
+
+# compute backscatter statistics per acquisition date with streaming aggregator - partitions on point id merged per date
+def aggregateTable( plist, args ):
+
+    names = [ 'gamma_vv', 'gamma_vh', 'snap_vv', 'snap_vh', 'vv_diff', 'vh_diff' ]
+    columns = [ name + '_' + stat for name in names[ :4 ] for stat in [ 'mean', 'stddev' ] ]
+
+    # get connection
+    conn = pgsql.getConnection( plist[ 'db' ] )
+    cur = conn.cursor()
+
+    try:
+
+        # existing tables retained unless appending new acquisitions
+        table, subfilter, exists, seq = getTableFilter( plist, cur, args.incremental )
+        if seq is not None:
+
+            query = "SELECT DATE(fdate), gamma_vv, gamma_vh, snap_vv, snap_vh, gamma_vv-snap_vv, gamma_vh-snap_vh FROM {} WHERE {} AND point_id %% %s = %s".format( pairs.getTable( plist ), subfilter )
+            state = stats.aggregate( plist[ 'db' ], [ ( query, ( args.threads, idx ) ) for idx in range( args.threads ) ], names, workers=args.threads )
+
+            # bulk load per date statistics - rmse is root mean square of algorithm difference
+            buffer = io.StringIO()
+            writer = csv.writer( buffer )
+            for fdate, record in sorted( stats.getResults( state ).items() ):
+                values = [ record[ column ] for column in columns ] + [ record[ 'vv_diff_rms' ], record[ 'vh_diff_rms' ] ]
+                writer.writerow( [ fdate ] + [ '' if value is None else value for value in values ] )
+
+            buffer.seek( 0 )
+
+            cur.execute( "CREATE TABLE IF NOT EXISTS %s.%s ( fdate DATE, %s, vv_rmse double precision, vh_rmse double precision );", 
+                            ( AsIs( plist[ 'out_schema' ] ), AsIs( table ), AsIs( ', '.join( [ column + ' double precision' for column in columns ] ) ) ) )
+            cur.copy_expert( "COPY {}.{} FROM STDIN WITH CSV".format( plist[ 'out_schema' ], table ), buffer )
+
+            pairs.setMerged( cur, plist, plist[ 'out_schema' ] + '.' + table, seq )
+
         conn.commit()
 
     # handle exception
@@ -71,7 +160,7 @@ def populateTable( plist ):
 
     # close connection
     print ( cur.query )
-    conn.close()
+    pgsql.releaseConnection( conn )
 
     return 
 
@@ -103,11 +192,32 @@ def parseArguments(args=None):
                         help='slope option (flat, steep, none)',
                         default='' )
 
+    parser.add_argument('-e', '--engine',  
+                        help='aggregation engine (sql, python)',
+                        choices=[ 'sql', 'python' ],
+                        default='sql' )
+
+    parser.add_argument('-n', '--threads',  
+                        type=int,
+                        help='number of concurrent partitions (python engine)',
+                        default=1 )
+
+    parser.add_argument('-i', '--incremental',  
+                        help='aggregate paired samples absent from existing timeline tables - dates of new samples recomputed',
+                        action='store_true' )
+
+    parser.add_argument('-r', '--rebuild',  
+                        help='rebuild paired sample table from result tables',
+                        action='store_true' )
+
     return parser.parse_args(args)
 
 
 # parse arguments
 args = parseArguments( sys.argv[1:] )
+
+# pooled connection per concurrent partition plus main thread
+pgsql.max_connections = max( pgsql.max_connections, args.threads + 1 )
 plist = { 'orbit' : args.orbit.upper(), 
             'product' : args.product, 
             'db' : args.database,
@@ -126,5 +236,10 @@ for ctype in landcover_types:
 
         # create and populate pgsql table
         plist[ 'landcover' ] = ctype
-        populateTable( plist )
+        pairs.refreshTable( plist, args.rebuild )
+
+        if args.engine == 'python':
+            aggregateTable( plist, args )
+        else:
+            populateTable( plist, args.incremental )
 
@@ -17,7 +17,13 @@ sys.path.insert(0, '/sac/bin/util')
 import ps
 import fio
 import parser
-import reproject
+
+# import shared project functions
+sys.path.insert(0, os.path.join( os.path.dirname( os.path.abspath( __file__ ) ), '../common' ) )
+import scheduler
+import manifest
+import raster
+from scene import checkScene, filterScenes
 
 # validate scene file and coverage
 def getSceneList( args ):
@@ -42,45 +48,73 @@ def getSceneList( args ):
                 if dt.timestamp() >= args.start.timestamp() and dt.timestamp() <= args.end.timestamp():
                     scene_list.append( obj )
 
+    # drop scenes with footprint outside aoi before processing starts
+    if args.aoi is not None:
+        scene_list = filterScenes( scene_list, args.aoi, args.manifest )
+
     return sorted( scene_list )
 
 
-# validate scene file and coverage
-def checkScene( pathname ):
+# get scene identifier and acquisition start time from zip pathname
+def getSceneId( pathname ):
 
-    sceneOK = False
+    scene_id = os.path.splitext( os.path.basename( pathname ) )[ 0 ]
+    return scene_id, scene_id.split( '_' )[ 4 ]
 
-    # decompress product file
-    path = os.path.dirname( pathname )
 
-    out, err, code = ps.execute( 'unzip', [ "-o", "-d", path, pathname ] )
-    if ( code <= 1 ):
+# geocode and reproject single scene
+def processScene( scene, args ):
 
-        filelist = fio.getFileList( '*.tiff', path )
-        if len( filelist ) > 0:
+    print ( 'processing scene: ' + scene )
+
+    # construct paths and logger
+    raw_path = os.path.dirname( scene )
+    ard_path = raw_path.replace( 'raw', 'ard' ) + "/gamma";
+
+    # skip scenes completed in previous runs with unchanged zip and parameters
+    params = { 'product' : args.product, 'res' : args.res, 'dem' : args.dem }
+    if not args.force and manifest.isComplete( args.manifest, scene, 'gamma_reproject', params ):
+        print ( '... scene already processed - skipping: ' + scene )
+        return 'done'
+
+    # check scene content and credentials
+    status = checkScene( scene, args.manifest )
+    if status == 'unreadable':
+        print ( 'unable to read scene: ' + scene )
+        return 'failed'
+
+    if status == 'crosses':
+        print ( 'scene crosses anti-meridian: ' + scene )
+        return 'skipped'
 
-            # open scene and extract gcps
-            in_ds = gdal.Open( filelist[ 0 ] )        
-            gcps = in_ds.GetGCPs()
+    out_path = os.path.join( ard_path, args.product )
+    scene_id, start = getSceneId( scene )
 
-            min_x = 180;  max_x = -180;
-            for gcp in gcps:
-            
-                min_x = min ( min_x, gcp.GCPX )
-                max_x = max ( max_x, gcp.GCPX )
+    if args.force or not manifest.isComplete( args.manifest, scene, 'gamma_geocode', params ):
 
-            # large longitude difference when crossing antimeridian 
-            if max_x - min_x < 10:                
-                sceneOK = True
-            else:
-                print ( '... scene crosses antimeridan - skipping: {}'.format ( pathname ) )
-            
-    # housekeeping of raw zip sub-folder
-    zip_path = os.path.splitext( pathname )[ 0 ]
-    if ( os.path.exists( zip_path ) ):
-        shutil.rmtree( zip_path )
+        # geocode scene - temporary files isolated per scene
+        geocode(scene=scene,
+            dem=args.dem,
+            tempdir=os.path.join(out_path, 'process', scene_id),
+            outdir=out_path,
+            targetres=args.res,
+            scaling='db',
+            func_geoback=1, 
+            # cleanup=False, 
+            export_extra=['inc_geo', 'ls_map_geo'] )
 
-    return sceneOK
+        manifest.setComplete( args.manifest, scene, 'gamma_geocode', params )
+
+    # reproject imagery to epsg:32760 - restrict to images generated from this scene
+    image_list = [ obj for obj in fio.getFileList ( 'S1*_{}*.tif'.format( start ), out_path ) if not obj.endswith( '_warp.tif' ) ]
+    for img_pathname in image_list:
+
+        # tiled, compressed output with overviews - ready for ingestion without further rewrite
+        warp_pathname = img_pathname.replace( '.tif', '_warp.tif' )
+        raster.warpToTiles( img_pathname, warp_pathname, 32760, 20 )
+
+    manifest.setComplete( args.manifest, scene, 'gamma_reproject', params )
+    return 'ok'
 
 
 # parse command line arguments
@@ -125,52 +159,47 @@ def parseArguments(args=None):
                         default=None,
                         type=valid_date )
 
+    parser.add_argument('-a', '--aoi',
+                        nargs=4,
+                        type=float,
+                        help='latitude / longitude bbox to filter scenes (xmin ymin xmax ymax)',
+                        default=None )
+
+    parser.add_argument('-w', '--workers',
+                        type=int,
+                        help='number of scenes processed concurrently',
+                        default=1 )
+
+    parser.add_argument('-m', '--maxtasks',
+                        type=int,
+                        help='scenes processed per worker before recycle',
+                        default=None )
+
+    parser.add_argument('--manifest',
+                        help='manifest recording completed scenes (default: <path>/manifest.db)',
+                        default=None )
+
+    parser.add_argument('--force',
+                        help='reprocess scenes recorded as complete in manifest',
+                        action='store_true' )
+
     return parser.parse_args(args)
 
 
 # parse arguments and check existence of dem file
 args = parseArguments( sys.argv[1:] )
+if args.manifest is None:
+    args.manifest = os.path.join( args.path, 'manifest.db' )
+
 if os.path.exists( args.dem ):
 
     # generate scene list from arguments
     scene_list = getSceneList( args )
     if len ( scene_list ) > 0:
 
-        for scene in scene_list:
-
-            print ( 'processing scene: ' + scene )
-
-            # construct paths and logger
-            raw_path = os.path.dirname( scene )
-            ard_path = raw_path.replace( 'raw', 'ard' ) + "/gamma";
-
-            # check scene content and credentials
-            if checkScene( scene ):
-
-                out_path = os.path.join( ard_path, args.product )
-
-                # geocode scene
-                geocode(scene=scene,
-                    dem=args.dem,
-                    tempdir=os.path.join(out_path, 'process'),
-                    outdir=out_path,
-                    targetres=args.res,
-                    scaling='db',
-                    func_geoback=1, 
-                    # cleanup=False, 
-                    export_extra=['inc_geo', 'ls_map_geo'] )
-
-                # reproject imagery to epsg:3460
-                image_list = fio.getFileList ( 'S1*.tif', out_path )
-                options = reproject.getTransform( image_list[ 0 ], { 't_epsg' : 32760, 'res_x' : 20, 'res_y' : 20  } )
-
-                for img_pathname in image_list:
-
-                    warp_pathname = img_pathname.replace( '.tif', '_warp.tif' )
-                    reproject.toEpsg( img_pathname, warp_pathname, options, [ 'TILED=YES', 'BLOCKXSIZE=256', 'BLOCKYSIZE=256' ] )
-
-            else:
-                print ( 'scene crosses anti-meridian: ' + scene )
+        # process scenes - optionally across pool of worker processes
+        results = scheduler.runTasks( processScene, scene_list, args, workers=args.workers, maxtasks=args.maxtasks )
+        scheduler.printSummary( results )
 
     else:
         print ( 'no scenes found: ' + args.path )
@@ -2,12 +2,21 @@
 
 import os
 import sys
+import io
+import csv
 import json
+import argparse
+import itertools
+from multiprocessing import Pool
 from collections import OrderedDict
 
 import psycopg2
 from psycopg2.extensions import AsIs
 
+# import shared project functions
+sys.path.insert(0, os.path.join( os.path.dirname( os.path.abspath( __file__ ) ), '../common' ) )
+import pgsql
+
 # import shared functions
 sys.path.insert(0, '/sac/bin/util')
 import fio
@@ -25,31 +34,11 @@ metadata = OrderedDict(  [  ( 'filename', 'VARCHAR(128)' ), \
                             ( 'footprint', 'VARCHAR(512)' ), \
                             ( 'orbitdirection', 'VARCHAR( 32 )' ) ] )
 
+# columns indexed for downstream joins
+index_list = [ 'fdate', 'orbitdirection', 'relativeorbitnumber' ]
 
-# locate unique key value from meta file
-def getInsertRecordSql( record ):
-
-    query = " ( '" +  record[ 0 ] + "', "
-    idx = 1
-
-    # for keys in metadata dict
-    for key in metadata:
-
-        # add quotes to string values
-        if 'INTEGER' in metadata[ key ]:
-            query += record[ idx ]
-        else:
-            query += "'" + record[ idx ] + "'"
-
-        # last item ?
-        if idx < len( record ) - 1 :   
-            query += ', '
-
-        idx = idx + 1
-
-    query += ' ) '
-
-    return query
+# records streamed per copy
+chunk_size = 10000
 
 
 # sql to create metadata db table
@@ -72,7 +61,7 @@ def getColumnListSql():
 def getCreateTableSql():
 
     # append column name and type to query string
-    query = 'CREATE TABLE meta ( id SERIAL PRIMARY KEY, fdate TIMESTAMP '
+    query = 'CREATE TABLE IF NOT EXISTS meta ( id SERIAL PRIMARY KEY, fdate TIMESTAMP '
     for key in metadata:
 
         if len( query ) > 0:
@@ -84,34 +73,83 @@ def getCreateTableSql():
     return query
 
 
-# create and initialise meta data table
-def initialiseTable( records, db ):
+# sql to upsert staged records into metadata table - filename uniquely identifies scene
+def getUpsertSql():
+
+    columns = getColumnListSql()
+
+    query = 'INSERT INTO meta ( ' + columns + ' ) SELECT DISTINCT ON ( filename ) ' + columns + ' FROM meta_staging ' \
+                'ON CONFLICT ( filename ) DO UPDATE SET '
+
+    query += ', '.join( [ key + ' = EXCLUDED.' + key for key in columns.split( ', ' ) if key != 'filename' ] )
+    return query + ';'
+
+
+# create metadata table if not exists and upsert records streamed via copy in chunks - loaded file states recorded in same transaction
+def initialiseTable( records, files, db ):
 
     # get connection
-    conn = psycopg2.connect("dbname='{}' user='sac' host='localhost' password='sac'".format( db ) )
+    conn = pgsql.getConnection( db )
     cur = conn.cursor()
 
     try:
 
-        # drop table if exists
-        cur.execute( "DROP TABLE IF EXISTS meta;" )
-        conn.commit()
-
         # create table with fields defined above
         cur.execute( getCreateTableSql() )
-        conn.commit()
 
-        # construct query to insert metadata records
-        query = 'INSERT INTO meta  ( ' + getColumnListSql() + ' ) VALUES '
-        for record in records:
+        # unique filename needed for upsert - duplicates loaded before index existed removed, newest row per filename retained
+        cur.execute( "SELECT to_regclass( 'meta_filename_idx' );" )
+        if cur.fetchone()[ 0 ] is None:
+
+            cur.execute( "DELETE FROM meta a USING meta b WHERE a.filename = b.filename AND a.id < b.id;" )
+            print ( '... removed {} duplicate records'.format( cur.rowcount ) )
+
+            cur.execute( "CREATE UNIQUE INDEX meta_filename_idx ON meta ( filename );" )
+
+        for column in index_list:
+            cur.execute( "CREATE INDEX IF NOT EXISTS meta_%s_idx ON meta ( %s );", ( AsIs( column ), AsIs( column ) ) )
+
+        # load watermark - size and mtime of each meta file parsed into table
+        cur.execute( "CREATE TABLE IF NOT EXISTS meta_loaded ( pathname TEXT PRIMARY KEY, size BIGINT, mtime DOUBLE PRECISION, loaded TIMESTAMP DEFAULT now() );" )
+
+        # staging table dropped on commit
+        cur.execute( "CREATE TEMP TABLE meta_staging ON COMMIT DROP AS SELECT " + getColumnListSql() + " FROM meta WITH NO DATA;" )
+
+        records = iter( records ); count = 0
+        while True:
 
-            query += getInsertRecordSql ( record ) 
+            chunk = list( itertools.islice( records, chunk_size ) )
+            if len( chunk ) == 0:
+                break
 
-            if record != records[-1] :   
-                query += ', '
+            # stream chunk as csv - empty fields loaded as null
+            buffer = io.StringIO()
+            csv.writer( buffer ).writerows( chunk )
+            buffer.seek( 0 )
 
-        # execute insert query
-        cur.execute( query )
+            cur.copy_expert( 'COPY meta_staging ( ' + getColumnListSql() + ' ) FROM STDIN WITH CSV', buffer )
+
+            # merge chunk into metadata table
+            cur.execute( getUpsertSql() )
+            cur.execute( "TRUNCATE meta_staging;" )
+
+            count += len( chunk )
+
+        # record files parsed in this run
+        buffer = io.StringIO()
+        csv.writer( buffer ).writerows( files )
+        buffer.seek( 0 )
+
+        cur.execute( "CREATE TEMP TABLE loaded_staging ( pathname TEXT, size BIGINT, mtime DOUBLE PRECISION ) ON COMMIT DROP;" )
+        cur.copy_expert( 'COPY loaded_staging FROM STDIN WITH CSV', buffer )
+        cur.execute( "INSERT INTO meta_loaded ( pathname, size, mtime ) SELECT pathname, size, mtime FROM loaded_staging " \
+                        "ON CONFLICT ( pathname ) DO UPDATE SET size = EXCLUDED.size, mtime = EXCLUDED.mtime, loaded = now();" )
+
+        conn.commit()
+        print ( '... upserted {} records'.format( count ) )
+
+        # refresh planner statistics
+        cur.execute( "ANALYZE meta;" )
         conn.commit()
 
     # handle exception
@@ -119,54 +157,127 @@ def initialiseTable( records, db ):
         print ( e.pgerror )    
 
     # close connection
-    # print ( cur.query )
-    conn.close()
+    pgsql.releaseConnection( conn )
+
 
-# locate unique key value from meta file
-def getValue( data, key ):
+# index named metadata entries in single pass - later entries override earlier
+def getIndex( data ):
 
-    value = None
+    index = {}
     for i in data.keys():
 
         for j in data[ i ]:
             
-            if type ( j ) is dict and 'name' in j and j[ 'name' ] == key:                
-                value = j[ 'content' ]
+            if type ( j ) is dict and 'name' in j:                
+                index[ j[ 'name' ] ] = j.get( 'content' )
 
-    return value                
+    return index                
 
 
-# get list of meta files from raw directory
-def getRecords( path ):
+# parse record from single meta file - executed within worker process
+def getRecord( pathname ):
 
-    # get list of meta files from raw directory
-    records = []
+    record = None
+
+    # parse date time from pathname
+    dt = parser.getDateTime( pathname )
+    if dt is not None:
+
+        with open( pathname ) as json_file:  
+
+            # create record    
+            index = getIndex( json.load(json_file) )
+            record = [ dt.strftime ( '%Y-%m-%d %H:%M:%S' ) ]
+
+            # copy values into record
+            for key in metadata.keys():
+                record.append ( index.get( key ) )
+
+    return record
+
+
+# get size and mtime of meta files already loaded into metadata table
+def getLoadedFiles( db ):
+
+    loaded = {}
+
+    # get connection
+    conn = pgsql.getConnection( db )
+    cur = conn.cursor()
+
+    try:
+
+        # execute query
+        cur.execute( "SELECT pathname, size, mtime FROM meta_loaded;" )
+        loaded = { row[ 0 ] : ( row[ 1 ], row[ 2 ] ) for row in cur.fetchall() }
+
+    # handle exception - table not yet created
+    except psycopg2.Error as e:
+        print ( e.pgerror )    
+
+    # close connection
+    pgsql.releaseConnection( conn )
 
+    return loaded
+
+
+# get records and file states of meta files from raw directory
+def getRecords( path, loaded=None, processes=1 ):
+
+    # get list of meta files from raw directory
     filelist = fio.getFileList( '*.meta', path )
-    for pathname in filelist:
+    files = [ [ obj, os.path.getsize( obj ), os.path.getmtime( obj ) ] for obj in filelist ]
+
+    # skip files loaded previously with unchanged size and mtime - copies preserving mtime still picked up as new paths
+    if loaded is not None:
+        files = [ obj for obj in files if loaded.get( obj[ 0 ] ) != ( obj[ 1 ], obj[ 2 ] ) ]
+
+    filelist = [ obj[ 0 ] for obj in files ]
+    print ( '... parsing {} meta files'.format( len( filelist ) ) )
+
+    # parse files across pool of worker processes - serial parse avoids pool start up
+    if processes > 1:
+
+        with Pool( processes=processes ) as pool:
+            records = pool.map( getRecord, filelist, chunksize=64 )
+
+    else:
+        records = [ getRecord( obj ) for obj in filelist ]
+
+    return [ record for record in records if record is not None ], files
+
+
+# parse command line arguments
+def parseArguments(args=None):
 
-        # parse date time from pathname
-        dt = parser.getDateTime( pathname )
-        if dt is not None:
+    parser = argparse.ArgumentParser(description='process-meta')
 
-            with open( pathname ) as json_file:  
+    parser.add_argument('-p', '--path',
+                        help='scene root path',
+                        default='/data/raw/alps/' )
 
-                # create record    
-                data = json.load(json_file)
-                record = [ dt.strftime ( '%Y-%m-%d %H:%M:%S' ) ]
+    parser.add_argument('-d', '--database',
+                        help='database',
+                        default='alps')
 
-                # copy values into dict
-                for key in metadata.keys():
-                    record.append ( getValue( data, key ) )
+    parser.add_argument('-n', '--processes',
+                        type=int,
+                        help='number of parser processes',
+                        default=1 )
 
-                records.append ( record )
+    parser.add_argument('-i', '--incremental',
+                        help='only parse meta files not loaded previously with same size and mtime',
+                        action='store_true' )
 
-    return records
+    return parser.parse_args(args)
 
 
-# entry point
-path = '/data/raw/alps/'
-db = 'alps'
+# parse arguments
+args = parseArguments( sys.argv[1:] )
 
-initialiseTable ( getRecords( path ), db )
+loaded = None
+if args.incremental:
+    loaded = getLoadedFiles( args.database )
 
+records, files = getRecords( args.path, loaded, args.processes )
+initialiseTable ( records, files, args.database )
@@ -16,6 +16,12 @@ import ps
 import fio
 import parser
 
+# import shared project functions
+sys.path.insert(0, os.path.join( os.path.dirname( os.path.abspath( __file__ ) ), '../common' ) )
+import scheduler
+import manifest
+from scene import filterScenes
+
 # validate scene file and coverage
 def getSceneList( args ):
 
@@ -39,45 +45,44 @@ def getSceneList( args ):
                 if dt.timestamp() >= args.start.timestamp() and dt.timestamp() <= args.end.timestamp():
                     scene_list.append( obj )
 
-    return sorted( scene_list )
-
+    # drop scenes with footprint outside aoi before processing starts
+    if args.aoi is not None:
+        scene_list = filterScenes( scene_list, args.aoi, args.manifest )
 
-# validate scene file and coverage
-def checkScene( pathname ):
+    return sorted( scene_list )
 
-    sceneOK = False
 
-    # decompress product file
-    path = os.path.dirname( pathname )
+# geocode single scene
+def processScene( scene, args ):
 
-    out, err, code = ps.execute( 'unzip', [ "-o", "-d", path, pathname ] )
-    if ( code <= 1 ):
+    print ( 'processing scene: ' + scene )
 
-        filelist = fio.getFileList( '*.tiff', path )
-        if len( filelist ) > 0:
+    # construct paths and logger
+    raw_path = os.path.dirname( scene )
+    ard_path = raw_path.replace( 'raw', 'ard' ) + "/snap";
 
-            # open scene and extract gcps
-            in_ds = gdal.Open( filelist[ 0 ] )        
-            gcps = in_ds.GetGCPs()
+    # skip scenes completed in previous runs with unchanged zip and parameters
+    params = { 'product' : args.product, 'res' : args.res, 'dem' : args.dem }
+    if not args.force and manifest.isComplete( args.manifest, scene, 'snap_geocode', params ):
+        print ( '... scene already processed - skipping: ' + scene )
+        return 'done'
 
-            min_x = 180;  max_x = -180;
-            for gcp in gcps:
-            
-                min_x = min ( min_x, gcp.GCPX )
-                max_x = max ( max_x, gcp.GCPX )
+    out_path = os.path.join( ard_path, args.product )
+    scene_id = os.path.splitext( os.path.basename( scene ) )[ 0 ]
 
-            # large longitude difference when crossing antimeridian 
-            if max_x - min_x < 10:                
-                sceneOK = True
-            else:
-                print ( '... scene crosses antimeridan - skipping: {}'.format ( pathname ) )
-            
-    # housekeeping of raw zip sub-folder
-    zip_path = os.path.splitext( pathname )[ 0 ]
-    if ( os.path.exists( zip_path ) ):
-        shutil.rmtree( zip_path )
+    # geocode scene - temporary files isolated per scene
+    snap.geocode(infile=scene,
+                 outdir=out_path, 
+                 t_srs=32632, tr=args.res,
+                 shapefile='/data/S1_ARD/code/aoi/testsite_alps.shp', 
+                 cleanup=False,
+                 tmpdir=os.path.join( out_path, 'process', scene_id ),
+                 export_extra=['incidenceAngleFromEllipsoid',
+                               'localIncidenceAngle',
+                               'projectedLocalIncidenceAngle', 'DEM' ], groupsize=1 )
 
-    return sceneOK
+    manifest.setComplete( args.manifest, scene, 'snap_geocode', params )
+    return 'ok'
 
 
 # parse command line arguments
@@ -125,41 +130,47 @@ def parseArguments(args=None):
                         default=None,
                         type=valid_date )
 
+    parser.add_argument('-a', '--aoi',
+                        nargs=4,
+                        type=float,
+                        help='latitude / longitude bbox to filter scenes (xmin ymin xmax ymax)',
+                        default=None )
+
+    parser.add_argument('-w', '--workers',
+                        type=int,
+                        help='number of scenes processed concurrently',
+                        default=1 )
+
+    parser.add_argument('-m', '--maxtasks',
+                        type=int,
+                        help='scenes processed per worker before recycle',
+                        default=None )
+
+    parser.add_argument('--manifest',
+                        help='manifest recording completed scenes (default: <path>/manifest.db)',
+                        default=None )
+
+    parser.add_argument('--force',
+                        help='reprocess scenes recorded as complete in manifest',
+                        action='store_true' )
+
     return parser.parse_args(args)
 
 
 # parse arguments and check existence of dem file
 args = parseArguments( sys.argv[1:] )
+if args.manifest is None:
+    args.manifest = os.path.join( args.path, 'manifest.db' )
+
 if os.path.exists( args.path ):
 
     # generate scene list from arguments
     scene_list = getSceneList( args )
     if len ( scene_list ) > 0:
 
-        for scene in scene_list:
-
-            print ( 'processing scene: ' + scene )
-
-            # construct paths and logger
-            raw_path = os.path.dirname( scene )
-            ard_path = raw_path.replace( 'raw', 'ard' ) + "/snap";
-
-            # check scene content and credentials
-            if True: # checkScene( scene ):
-
-                out_path = os.path.join( ard_path, args.product )
-
-                snap.geocode(infile=scene,
-                             outdir=out_path, 
-                             t_srs=32632, tr=args.res,
-                             shapefile='/data/S1_ARD/code/aoi/testsite_alps.shp', 
-                             cleanup=False,
-                             export_extra=['incidenceAngleFromEllipsoid',
-                                           'localIncidenceAngle',
-                                           'projectedLocalIncidenceAngle', 'DEM' ], groupsize=1 )
-
-            else:
-                print ( 'scene crosses anti-meridian: ' + scene )
+        # process scenes - optionally across pool of worker processes
+        results = scheduler.runTasks( processScene, scene_list, args, workers=args.workers, maxtasks=args.maxtasks )
+        scheduler.printSummary( results )
 
     else:
         print ( 'no scenes found: ' + args.path )
@@ -12,6 +12,10 @@ import datetime as dt
 
 from psycopg2.extensions import AsIs
 
+# import shared project functions
+sys.path.insert(0, os.path.join( os.path.dirname( os.path.abspath( __file__ ) ), '../common' ) )
+import pgsql
+
 import numpy as np
 from matplotlib import pyplot as plt
 from matplotlib.offsetbox import AnchoredText
@@ -63,7 +67,7 @@ def getRecords( plist ):
     records = None
 
     # get connection
-    conn = psycopg2.connect("dbname='{}' user='sac' host='localhost' password='sac'".format( plist[ 'db' ] ) )
+    conn = pgsql.getConnection( plist[ 'db' ] )
     cur = conn.cursor()
 
     # determine table of reference
@@ -98,7 +102,7 @@ def getRecords( plist ):
 
     # close connection
     print ( cur.query )
-    conn.close()
+    pgsql.releaseConnection( conn )
 
     return records
 
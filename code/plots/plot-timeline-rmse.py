@@ -12,6 +12,10 @@ import datetime as dt
 
 from psycopg2.extensions import AsIs
 
+# import shared project functions
+sys.path.insert(0, os.path.join( os.path.dirname( os.path.abspath( __file__ ) ), '../common' ) )
+import pgsql
+
 from matplotlib import pyplot as plt
 from matplotlib.offsetbox import AnchoredText
 
@@ -63,7 +67,7 @@ def getData( records ):
 def getRecords( plist, schema ):
 
     # get connection
-    conn = psycopg2.connect("dbname='{}' user='sac' host='localhost' password='sac'".format ( plist[ 'db' ] ) )
+    conn = pgsql.getConnection( plist[ 'db' ] )
     cur = conn.cursor()
 
     # visualise temporal stack statistics
@@ -71,13 +75,13 @@ def getRecords( plist, schema ):
     if plist[ 'orbit' ] == 'ASCENDING' or plist[ 'orbit' ] == 'DESCENDING':   
 
         # switch on optional orbit direction filter
-        query = "SELECT extract( epoch from fdate ), %s_rmse FROM %s.%s_%s_%s";
+        query = "SELECT extract( epoch from fdate ), %s_rmse FROM %s.%s_%s_%s ORDER BY fdate";
         param_list = ( AsIs( plist[ 'pol' ] ),                             
                             AsIs( schema ), AsIs( plist[ 'product' ] ), AsIs( plist[ 'landcover' ] ),  AsIs( plist[ 'orbit' ] ) )
 
     else:
 
-        query = "SELECT extract( epoch from fdate ), %s_rmse FROM %s.%s_%s";
+        query = "SELECT extract( epoch from fdate ), %s_rmse FROM %s.%s_%s ORDER BY fdate";
         param_list = ( AsIs( plist[ 'pol' ] ),
                             AsIs( schema ), AsIs( plist[ 'product' ] ), AsIs( plist[ 'landcover' ] ) )
 
@@ -93,7 +97,7 @@ def getRecords( plist, schema ):
 
     # close connection
     print ( cur.query )
-    conn.close()
+    pgsql.releaseConnection( conn )
 
     return records
 
@@ -12,6 +12,10 @@ import datetime as dt
 
 from psycopg2.extensions import AsIs
 
+# import shared project functions
+sys.path.insert(0, os.path.join( os.path.dirname( os.path.abspath( __file__ ) ), '../common' ) )
+import pgsql
+
 from matplotlib import pyplot as plt
 import matplotlib
 import matplotlib.dates as mdates
@@ -64,7 +68,7 @@ def getData( records ):
 def getRecords( plist ):
 
     # get connection
-    conn = psycopg2.connect("dbname='{}' user='sac' host='localhost' password='sac'".format ( plist[ 'db' ] ) )
+    conn = pgsql.getConnection( plist[ 'db' ] )
     cur = conn.cursor()
 
     # visualise temporal stack statistics
@@ -72,14 +76,14 @@ def getRecords( plist ):
     if plist[ 'orbit' ] == 'ASCENDING' or plist[ 'orbit' ] == 'DESCENDING':   
 
         # switch on optional orbit direction filter
-        query = "SELECT extract( epoch from fdate ), %s_%s_mean, %s_%s_stddev FROM %s.%s_%s_%s";
+        query = "SELECT extract( epoch from fdate ), %s_%s_mean, %s_%s_stddev FROM %s.%s_%s_%s ORDER BY fdate";
         param_list = ( AsIs( plist[ 'alg' ] ), AsIs( plist[ 'pol' ] ), 
                             AsIs( plist[ 'alg' ] ), AsIs( plist[ 'pol' ] ),  
                                 AsIs( plist[ 'schema' ] ), AsIs( plist[ 'product' ] ), AsIs( plist[ 'landcover' ] ),  AsIs( plist[ 'orbit' ] ) )
 
     else:
 
-        query = "SELECT extract( epoch from fdate ), %s_%s_mean, %s_%s_stddev FROM %s.%s_%s";
+        query = "SELECT extract( epoch from fdate ), %s_%s_mean, %s_%s_stddev FROM %s.%s_%s ORDER BY fdate";
         param_list = ( AsIs( plist[ 'alg' ] ), AsIs( plist[ 'pol' ] ), 
                             AsIs( plist[ 'alg' ] ), AsIs( plist[ 'pol' ] ),  
                                 AsIs( plist[ 'schema' ] ), AsIs( plist[ 'product' ] ), AsIs( plist[ 'landcover' ] ) )
@@ -96,7 +100,7 @@ def getRecords( plist ):
 
     # close connection
     print ( cur.query )
-    conn.close()
+    pgsql.releaseConnection( conn )
 
     return records
 
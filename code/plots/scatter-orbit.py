@@ -12,6 +12,10 @@ import datetime as dt
 
 from psycopg2.extensions import AsIs
 
+# import shared project functions
+sys.path.insert(0, os.path.join( os.path.dirname( os.path.abspath( __file__ ) ), '../common' ) )
+import pgsql
+
 sys.path.insert(0, '../.')
 from S1_ARD import scatter
 from util import saveFile
@@ -60,12 +64,12 @@ def getRecords( plist ):
     records = None
 
     # get connection
-    conn = psycopg2.connect("dbname='{}' user='sac' host='localhost' password='sac'".format( plist[ 'db' ] ) )
+    conn = pgsql.getConnection( plist[ 'db' ] )
     cur = conn.cursor()
 
     # get error statistics filtered by orbit direction
     query = "WITH pts AS( SELECT a.%s_%s_mean mean_a, a.%s_%s_stddev stddev_a, b.%s_%s_mean mean_d, b.%s_%s_stddev stddev_d FROM %s.%s_%s_ascending a " \
-                "INNER JOIN %s.%s_%s_descending b ON a.geom = b.geom ) SELECT mean_a, mean_d FROM pts WHERE stddev_a < %s AND stddev_d < %s;"
+                "INNER JOIN %s.%s_%s_descending b ON a.point_id = b.point_id ) SELECT mean_a, mean_d FROM pts WHERE stddev_a < %s AND stddev_d < %s;"
 
     param_list = ( AsIs( plist[ 'alg' ] ), AsIs( plist[ 'pol' ] ), AsIs( plist[ 'alg' ] ), AsIs( plist[ 'pol' ] ), 
                         AsIs( plist[ 'alg' ] ), AsIs( plist[ 'pol' ] ), AsIs( plist[ 'alg' ] ), AsIs( plist[ 'pol' ] ), 
@@ -85,7 +89,7 @@ def getRecords( plist ):
 
     # close connection
     print ( cur.query )
-    conn.close()
+    pgsql.releaseConnection( conn )
 
     return records
 
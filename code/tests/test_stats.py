@@ -0,0 +1,81 @@
+#!/usr/bin/env python
+
+import os
+import sys
+
+import numpy as np
+import pytest
+
+# import shared project functions
+sys.path.insert(0, os.path.join( os.path.dirname( os.path.abspath( __file__ ) ), '../common' ) )
+import stats
+
+names = [ 'vv', 'vh' ]
+
+# random samples of interleaved groups with missing values
+def getSamples( seed, rows=5000, groups=97 ):
+
+    rng = np.random.default_rng( seed )
+
+    keys = rng.integers( 0, groups, rows ) * 7 - 300
+    values = rng.normal( -12.0, 3.0, ( rows, len( names ) ) )
+    values[ rng.random( values.shape ) < 0.05 ] = np.nan
+
+    return keys, values
+
+
+# compare per key results against numpy over complete sample
+def checkResults( results, keys, values ):
+
+    assert sorted( results.keys() ) == sorted( np.unique( keys ).tolist() )
+    for key, record in results.items():
+
+        for col, name in enumerate( names ):
+
+            data = values[ keys == key, col ]
+            data = data[ ~np.isnan( data ) ]
+
+            assert record[ name + '_count' ] == len( data )
+            assert record[ name + '_mean' ] == pytest.approx( np.mean( data ), rel=1e-12 )
+            assert record[ name + '_stddev' ] == pytest.approx( np.std( data, ddof=1 ), rel=1e-10 )
+            assert record[ name + '_sum' ] == pytest.approx( np.sum( data ), rel=1e-12 )
+            assert record[ name + '_m2' ] == pytest.approx( np.sum( ( data - np.mean( data ) ) ** 2 ), rel=1e-10 )
+
+
+def test_update_state_batches():
+
+    keys, values = getSamples( 1 )
+
+    # batches smaller than number of groups exercise lookup growth
+    state = stats.getState( names )
+    for start in range( 0, len( keys ), 61 ):
+        stats.updateState( state, keys[ start:start + 61 ], values[ start:start + 61 ] )
+
+    checkResults( stats.getResults( state ), keys, values )
+
+
+def test_merge_state_partitions():
+
+    keys, values = getSamples( 2 )
+
+    # partial states over disjoint row partitions with overlapping keys
+    state = stats.getState( names )
+    for idx in range( 4 ):
+
+        partial = stats.getState( names )
+        stats.updateState( partial, keys[ idx::4 ], values[ idx::4 ] )
+        stats.mergeState( state, partial )
+
+    checkResults( stats.getResults( state ), keys, values )
+
+
+def test_undefined_statistics():
+
+    state = stats.getState( names )
+    stats.updateState( state, [ 1, 2, 2 ], [ [ 1.0, np.nan ], [ 2.0, np.nan ], [ 4.0, 3.0 ] ] )
+
+    results = stats.getResults( state )
+    assert results[ 1 ][ 'vv_stddev' ] is None
+    assert results[ 1 ][ 'vh_mean' ] is None
+    assert results[ 2 ][ 'vh_count' ] == 1
+    assert results[ 2 ][ 'vv_stddev' ] == pytest.approx( np.std( [ 2.0, 4.0 ], ddof=1 ) )